@@ -0,0 +1,71 @@
+"""Micro-benchmark: SongQueue vs. the plain list it replaced.
+
+Run with `python bench_queue.py`. Each operation is repeated on a queue of
+10k and 100k entries; times are per operation in microseconds.
+"""
+import random
+import timeit
+
+from songqueue import SongQueue
+
+SIZES = (10_000, 100_000)
+REPEATS = 2_000
+
+
+def make_entries(size):
+    return [f"downloads/song_{i}.mp3" for i in range(size)]
+
+
+def bench(label, make_queue, operation, size):
+    queue = make_queue(make_entries(size))
+    rng = random.Random(size)
+    seconds = timeit.timeit(lambda: operation(queue, rng), number=REPEATS)
+    return label, seconds / REPEATS * 1_000_000
+
+
+def dequeue(queue, rng):
+    item = queue.pop(0)
+    queue.append(item)  # Keep the size steady
+
+
+def insert_middle(queue, rng):
+    queue.insert(len(queue) // 2, "downloads/new.mp3")
+    queue.pop(len(queue) // 2)
+
+
+def remove_random(queue, rng):
+    item = queue.pop(rng.randrange(len(queue)))
+    queue.append(item)
+
+
+def move_random(queue, rng):
+    item = queue.pop(rng.randrange(len(queue)))
+    queue.insert(rng.randrange(len(queue)), item)
+
+
+def page_slice(queue, rng):
+    start = rng.randrange(len(queue) - 10)
+    queue[start:start + 10]
+
+
+OPERATIONS = {
+    "dequeue (pop 0)": dequeue,
+    "insert-at middle": insert_middle,
+    "remove-at random": remove_random,
+    "move random": move_random,
+    "page slice (10)": page_slice,
+}
+
+
+def main():
+    for size in SIZES:
+        print(f"\n{size:,} entries (µs per op)")
+        print(f"{'operation':<20}{'list':>12}{'SongQueue':>12}")
+        for name, operation in OPERATIONS.items():
+            _, list_time = bench("list", list, operation, size)
+            _, queue_time = bench("SongQueue", SongQueue, operation, size)
+            print(f"{name:<20}{list_time:>12.2f}{queue_time:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
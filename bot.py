@@ -1,15 +1,26 @@
 import os
 import discord
 from discord.ext import commands, tasks
-import yt_dlp as youtube_dl
 import asyncio
 import random
 import math
 import json
-from mutagen.mp3 import MP3
-from mutagen.wave import WAVE
+import sys
+import itertools
+import time
+import re
+import hashlib
+import shutil
+import shlex
+import aiohttp
+from collections import defaultdict, deque, OrderedDict
 from discord.ui import View, Select, Button
 from discord import Interaction
+from songqueue import SongQueue, LazySegment
+from tagindex import TagIndex, parse_tag_query, describe_tag_query
+from catalog import Upload, UploadCatalog
+from storage import UploadStore, PlaylistStore
+from persistence import WriteBehindPersister
 from datetime import datetime
 
 # Load environment variables (Ensure TOKEN is stored in Railway Variables or .env file)
@@ -23,32 +34,11 @@ intents.members = True  # Allow the bot to track server members (including itsel
 MUSIC_FOLDER = "downloads/"
 os.makedirs(MUSIC_FOLDER, exist_ok=True)
 
-# Main playlist storage
-playlists_by_guild = {}
-PLAYLISTS_FILE = "playlists.json"
-
-# Load existing playlists
-
-def load_playlists():
-    global playlists_by_guild
-    if os.path.exists(PLAYLISTS_FILE):
-        with open(PLAYLISTS_FILE, "r") as f:
-            playlists_by_guild = json.load(f)
-    else:
-        playlists_by_guild = {}
-
-# Save playlists
-
-def save_playlists():
-    with open(PLAYLISTS_FILE, "w") as f:
-        json.dump(playlists_by_guild, f, indent=2)
-
-# Ensure every guild has an initialized dict
-
-def ensure_guild_playlists(guild_id):
-    guild_id = str(guild_id)
-    if guild_id not in playlists_by_guild:
-        playlists_by_guild[guild_id] = {}
+# Each YouTube download runs in its own scratch folder, so a cancelled or failed one
+# can't leave yt-dlp's .part files behind. Leftovers from a crash are cleared at startup.
+DOWNLOAD_SCRATCH_FOLDER = os.path.join(MUSIC_FOLDER, "partial")
+shutil.rmtree(DOWNLOAD_SCRATCH_FOLDER, ignore_errors=True)
+os.makedirs(DOWNLOAD_SCRATCH_FOLDER, exist_ok=True)
 
 # Configure YouTube downloader settings
 cookies_path = "/app/cookies.txt"
@@ -109,7 +99,9 @@ async def help(ctx):
                     "⏹️ **!stop** – Bring the music to a gentle halt & clear the queue\n"
                     "🔊 **!volume** – Adjust the warmth of sound. Alias: v\n"
                     "🔀 **!shuffle** – Let the winds of chance guide your queue.\n"
-                    "📜 **!queue** – View the glowing journey ahead. Alias: q"
+                    "📜 **!queue** – View the glowing journey ahead. Alias: q\n"
+                    "🔃 **!move** / **!remove** / **!insert** – Rearrange the queue by position\n"
+                    "🌊 **!streammode** – Stream YouTube songs directly instead of downloading first"
                 )
             elif "Uploads" in choice:
                 embed.title = "📂 Uploads – Curate your cozy corner"
@@ -119,13 +111,15 @@ async def help(ctx):
                     "📄 **!playbypage** – Tune into pages of your musical journey. Alias: pp\n"
                     "🌎 **!playalluploads** – Let every note shine at once - mixed with magic.\n"
                     "❌ **!deleteupload** – Tuck a song away to make room for more stars. Alias: du\n"
+                    "💾 **!storagestats** – See how much space uploads take, and how much sharing saves\n"
+                    "✏️ **!renameupload** – Give an uploaded song a new name without changing its number\n"
                     "🧹 **!clearuploads** – Sweep the canvas clean for new creations. Alias: cu"
                 )
             elif "Tagging" in choice:
                 embed.title = "🏷️ Tagging System – Organize with heart"
                 embed.description = (
                     "🔖 **!tag** – Let your songs blossom with custom tags like 'sunrise', 'cozy', or 'adventure'.\n"
-                    "💚 **!playbytag** – Play all songs sharing the same spark of light.\n"
+                    "💚 **!playbytag** – Play all songs sharing the same spark of light (`+tag` to require, `-tag` to exclude).\n"
                     "📑 **!listtags** – See the beautiful constellation of tags you've created.\n"
                     "🌿 **!removetag** – Breeze away a tag or free songs from all their labels. Alias: untag."
                 )
@@ -135,6 +129,7 @@ async def help(ctx):
                     "🔗 **!join** – Call down a beam of warmth — Echosol arrives, heart first.\n"
                     "🚪 **!leave** – Let the light return to the stars\n"
                     "🧺 **!clearqueue** – Empty the queue and start fresh. Alias: cq\n"
+                    "📊 **!stats** – Peek at Echosol's inner workings\n"
                     "💡 **!help** – You're never alone – revisit this guide anytime."
                 )
 
@@ -173,51 +168,1116 @@ YDL_OPTIONS = {
     },
 }
 
+# Streaming mode resolves the direct audio URL and lets FFmpeg read it over HTTP.
+# No postprocessor: nothing is downloaded or transcoded before the first note.
+YDL_STREAM_OPTIONS = {
+    key: value for key, value in YDL_OPTIONS.items()
+    if key not in ('postprocessors', 'outtmpl')
+}
+
+# 🎼 Opus passthrough — prefer Opus formats and hand them to Discord without re-encoding.
+# No mp3 postprocessor either: the downloaded webm is played as-is.
+OPUS_PASSTHROUGH = os.getenv("OPUS_PASSTHROUGH", "off").lower() in ("1", "true", "yes", "on")
+OPUS_FORMAT = 'bestaudio[acodec=opus]/bestaudio[ext=webm]/bestaudio[ext=m4a]/bestaudio/best'
+OPUS_BITRATE = 128  # kbps, only used when an Opus encode can't be avoided
+YDL_OPUS_OPTIONS = {**YDL_STREAM_OPTIONS, 'format': OPUS_FORMAT, 'outtmpl': YDL_OPTIONS['outtmpl']}
+YDL_OPUS_STREAM_OPTIONS = {**YDL_STREAM_OPTIONS, 'format': OPUS_FORMAT}
+YDL_DOWNLOAD_OPTIONS = YDL_OPUS_OPTIONS if OPUS_PASSTHROUGH else YDL_OPTIONS
+if OPUS_PASSTHROUGH:
+    YDL_STREAM_OPTIONS = YDL_OPUS_STREAM_OPTIONS
+
+# Playlists are read flat: one request returns every entry's URL and title, and each
+# entry is only resolved when prefetch or playback reaches it
+YDL_FLAT_OPTIONS = {**YDL_STREAM_OPTIONS, 'extract_flat': 'in_playlist'}
+
+# Reconnect flags are input options, so they belong in before_options
 FFMPEG_OPTIONS = {
-    'options': '-vn -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+    'before_options': '-nostdin -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+    'options': '-vn'
 }
 FFMPEG_LOCAL_OPTIONS = {
     'before_options': '-nostdin',
     'options': '-vn'
 }
 
-from collections import defaultdict
-usage_counters = defaultdict(int)
-pending_tag_uploads = defaultdict(dict)  # {guild_id: {user_id: [filenames]}}
-file_tags_by_guild = defaultdict(dict)
-uploaded_files_by_guild = defaultdict(list)
-song_queue_by_guild = defaultdict(list)
-last_now_playing_message_by_guild = defaultdict(lambda: None)
-volume_levels_by_guild = defaultdict(lambda: 1.0)
+# 🧵 Extractor worker pool — yt-dlp runs in long-lived worker processes (see workers.py)
+# so a slow or hung extraction in one guild never freezes the event loop for everyone.
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workers.py")
+WORKER_LINE_LIMIT = 64 * 1024 * 1024  # Playlist replies can be large
+EXTRACTOR_WORKERS = int(os.getenv("EXTRACTOR_WORKERS", "3"))
+EXTRACTOR_TIMEOUT = float(os.getenv("EXTRACTOR_TIMEOUT", "120"))
+
+# Scheduling classes for pool jobs, most urgent first
+PRIORITY_PLAYBACK = 0  # The track about to play
+PRIORITY_PREFETCH = 1  # Upcoming tracks and stream URL refreshes
+PRIORITY_PLAYLIST = 2  # Reading playlists and their entries
+PRIORITY_METADATA = 3  # Title and duration lookups
+PRIORITY_NAMES = ("playback", "prefetch", "playlist", "metadata")
+STARVATION_SECONDS = float(os.getenv("SCHEDULER_STARVATION_SECONDS", "30"))  # Then a waiting job jumps the classes
+DOWNLOAD_BANDWIDTH_LIMIT = int(os.getenv("DOWNLOAD_BANDWIDTH_KBPS", "0")) * 1024  # Bytes/s across all downloads, 0 = off
+
+class WorkerError(Exception):
+    """Raised when a worker job fails, times out or the worker dies."""
+
+class WorkerPool:
+    """A bounded pool of worker processes driven through an async API.
+
+    At most `size` jobs run at once. When a slot frees up it goes to the
+    most urgent priority class, and within a class the guilds take turns,
+    so one guild loading a huge playlist can't crowd out everyone else. A
+    job that has waited longer than `starvation_seconds` goes first whatever
+    its class (None turns that off, for pools whose low class may wait).
+    A job that times out or is cancelled kills its worker, so a hung
+    extraction can't hold a slot forever. Workers are spawned on demand.
+    """
+
+    def __init__(self, name, size, timeout, starvation_seconds=STARVATION_SECONDS):
+        self.name = name
+        self.starvation_seconds = starvation_seconds
+        self.size = size
+        self.timeout = timeout
+        self.free_slots = size
+        self.waiters = [OrderedDict() for _ in PRIORITY_NAMES]  # Per class: {guild_id: deque of (future, queued_at)}
+        self.class_stats = [{"jobs": 0, "wait_total": 0.0, "wait_max": 0.0, "starved": 0} for _ in PRIORITY_NAMES]
+        self.idle_workers = []
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self._job_ids = itertools.count(1)
+
+    def waiting_in(self, priority):
+        return sum(
+            1 for queue in self.waiters[priority].values() for waiter, _ in queue if not waiter.done()
+        )
+
+    async def _acquire(self, priority, guild_id):
+        queued_at = time.monotonic()
+        if self.free_slots and not self.waiting:
+            self.free_slots -= 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters[priority].setdefault(guild_id, deque()).append((waiter, queued_at))
+            self.waiting += 1
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():  # Handed a slot just as we were cancelled
+                    self._release()
+                raise
+            finally:
+                self.waiting -= 1
+        waited = time.monotonic() - queued_at
+        stats = self.class_stats[priority]
+        stats["jobs"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+
+    def _release(self):
+        waiter = self._next_waiter()
+        if waiter is None:
+            self.free_slots += 1
+        else:
+            waiter.set_result(None)  # The slot passes straight to the next job
+
+    def _pop_waiter(self, priority):
+        """Next live waiter of a class, taking its guilds in turn."""
+        guilds = self.waiters[priority]
+        while guilds:
+            guild_id, queue = next(iter(guilds.items()))
+            waiter, _ = queue.popleft()
+            if queue:
+                guilds.move_to_end(guild_id)
+            else:
+                del guilds[guild_id]
+            if not waiter.done():  # Cancelled waiters are skipped here rather than searched for
+                return waiter
+        return None
+
+    def _next_waiter(self):
+        now = time.monotonic()
+        for priority in range(1, len(self.waiters) if self.starvation_seconds is not None else 1):
+            if any(
+                queue and not queue[0][0].done() and now - queue[0][1] > self.starvation_seconds
+                for queue in self.waiters[priority].values()
+            ):
+                waiter = self._pop_waiter(priority)
+                if waiter is not None:
+                    self.class_stats[priority]["starved"] += 1
+                    return waiter
+        for priority in range(len(self.waiters)):
+            waiter = self._pop_waiter(priority)
+            if waiter is not None:
+                return waiter
+        return None
+
+    @property
+    def queue_depth(self):
+        return self.waiting + self.running
+
+    async def _spawn(self):
+        return await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=WORKER_LINE_LIMIT,
+        )
+
+    async def run(self, op, timeout=None, priority=PRIORITY_PLAYBACK, guild_id=None, **job):
+        await self._acquire(priority, guild_id)
+        self.running += 1
+        worker = None
+        healthy = False
+        try:
+            worker = self.idle_workers.pop() if self.idle_workers else await self._spawn()
+            request = {"id": next(self._job_ids), "op": op, **job}
+            worker.stdin.write((json.dumps(request) + "\n").encode())
+            await worker.stdin.drain()
+
+            try:
+                line = await asyncio.wait_for(worker.stdout.readline(), timeout or self.timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise WorkerError(f"{self.name} job timed out after {timeout or self.timeout:.0f}s")
+            if not line:
+                raise WorkerError(f"{self.name} worker exited unexpectedly")
+
+            reply = json.loads(line)
+            healthy = True
+            if not reply["ok"]:
+                self.failed += 1
+                raise WorkerError(reply["error"])
+            self.completed += 1
+            return reply["result"]
+        finally:
+            self.running -= 1
+            if worker is not None:
+                if healthy and worker.returncode is None:
+                    self.idle_workers.append(worker)
+                elif worker.returncode is None:
+                    worker.kill()  # Timed out, cancelled or confused — start fresh next time
+            self._release()
+
+extractor_pool = WorkerPool("extractor", EXTRACTOR_WORKERS, EXTRACTOR_TIMEOUT)
+
+# 📥 Ingest pool — heavier per-upload jobs (encoding, later probing) get their own workers
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_TIMEOUT = float(os.getenv("INGEST_TIMEOUT", "600"))
+# A backfill can queue the whole library, so it never jumps ahead of uploads people are waiting on
+INGEST_PRIORITY_UPLOAD = PRIORITY_PLAYBACK  # Probing an attachment before it is accepted
+INGEST_PRIORITY_PROCESS = PRIORITY_PREFETCH  # Loudness and Opus copy for a new upload
+INGEST_PRIORITY_BACKFILL = PRIORITY_METADATA  # Existing uploads and cached tracks, in the background
+ingest_pool = WorkerPool("ingest", INGEST_WORKERS, INGEST_TIMEOUT, starvation_seconds=None)
+
+# 🌊 Streaming vs. download-then-play, globally via STREAM_MODE or per guild via !streammode
+STREAM_MODE_DEFAULT = os.getenv("STREAM_MODE", "off").lower() in ("1", "true", "yes", "on")
+stream_mode_by_guild = {}
+LONG_TRACK_SECONDS = 600
+
+# Time from dequeuing a YouTube track to handing audio to the voice client, per mode
+start_latency_samples = {
+    "stream": deque(maxlen=100),
+    "download": deque(maxlen=100),
+    "cache": deque(maxlen=100),
+}
 
-SAVE_FILE = "uploads_data.json"
+# Time from a !play that found the player idle to its first audio, voice handshake included
+play_command_latency = deque(maxlen=100)
+play_requested_at = {}  # {guild_id: when the !play that will start playback arrived}
+
+def is_stream_mode(guild_id):
+    return stream_mode_by_guild.get(guild_id, STREAM_MODE_DEFAULT)
+
+def record_start_latency(mode, seconds, duration):
+    start_latency_samples[mode].append((seconds, duration or 0))
+    print(f"[Latency] {mode} start took {seconds:.2f}s for a {duration or 0}s track")
+
+def stream_ffmpeg_options(info):
+    """FFMPEG_OPTIONS plus the HTTP headers yt-dlp says the stream URL needs."""
+    options = dict(FFMPEG_OPTIONS)
+    headers = info.get('http_headers') or {}
+    if headers:
+        header_blob = ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+        # discord.py splits these with shlex, so quote them the same way
+        options['before_options'] += f" -headers {shlex.quote(header_blob)}"
+    return options
+
+audio_source_stats = {"opus_copy": 0, "opus_encode": 0, "pcm": 0}
+
+def make_audio_source(song_url, ffmpeg_options, acodec, volume):
+    """Builds the cheapest audio source that still honours the guild's volume and the track's loudness gain.
+
+    Opus input at full volume is remuxed with codec copy, so FFmpeg never decodes
+    it and discord.py never re-encodes it. Anything else in passthrough mode is
+    encoded to Opus once by FFmpeg; outside passthrough mode we keep the PCM path.
+    """
+    if acodec == "opus" and volume == 1.0:
+        audio_source_stats["opus_copy"] += 1
+        return discord.FFmpegOpusAudio(song_url, codec="copy", **ffmpeg_options)
+    if OPUS_PASSTHROUGH:
+        audio_source_stats["opus_encode"] += 1
+        options = dict(ffmpeg_options)
+        if volume != 1.0:
+            options['options'] = f"{options.get('options', '')} -filter:a volume={volume}".strip()
+        return discord.FFmpegOpusAudio(song_url, bitrate=OPUS_BITRATE, **options)
+
+    audio_source_stats["pcm"] += 1
+    return discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(song_url, **ffmpeg_options), volume)
+
+async def extract_info(url, download=False, options=None, playlist_items=None, priority=PRIORITY_PLAYBACK, guild_id=None, download_folder=None):
+    """Runs yt-dlp's extract_info in the extractor pool and returns a slimmed info dict."""
+    options = options or YDL_OPTIONS
+    if download and DOWNLOAD_BANDWIDTH_LIMIT:
+        # Every worker may be downloading at once, so each gets an equal share of the budget
+        options = {**options, 'ratelimit': DOWNLOAD_BANDWIDTH_LIMIT // EXTRACTOR_WORKERS}
+    return await extractor_pool.run(
+        "extract", priority=priority, guild_id=guild_id,
+        url=url, download=download, options=options, playlist_items=playlist_items,
+        download_folder=download_folder,
+    )
 
-def save_upload_data():
+# 🔗 Stream URL cache — signed direct URLs are reused until shortly before they expire
+STREAM_URL_PROFILE = "opus" if OPUS_PASSTHROUGH else "bestaudio"  # Which format selection produced the URL
+STREAM_URL_DEFAULT_TTL = 1800  # For URLs that don't say when they expire
+STREAM_URL_MARGIN = 120  # A URL must outlive the whole track by this much to be used
+STREAM_REFRESH_DEPTH = 3  # Queued entries per streaming guild kept resolved ahead of time
+STREAM_REFRESH_AHEAD = 900  # Seconds before a URL stops being usable that the refresher replaces it
+STREAM_EARLY_FAILURE_SECONDS = 5  # A stream ending this fast most likely hit a rejected (403) URL
+STREAM_EXPIRE_PATTERN = re.compile(r"[?&/]expire[=/](\d+)")
+stream_url_cache = {}  # {"youtube:<id>:<profile>": {"info": slim info, "expires": unix time}}
+stream_url_fetches = {}  # {cache key: Task} so one URL is never resolved twice at once
+stream_url_stats = {"hits": 0, "misses": 0, "refreshes": 0, "retries": 0}
+
+def stream_url_key(url):
+    video_id = canonical_video_id(url)
+    return f"{video_id}:{STREAM_URL_PROFILE}" if video_id else None
+
+def stream_url_expiry(stream_url):
+    match = STREAM_EXPIRE_PATTERN.search(stream_url or "")
+    return int(match.group(1)) if match else time.time() + STREAM_URL_DEFAULT_TTL
+
+def stream_url_fresh(expires, duration, ahead=0):
+    """Whether a URL will still be valid when a track started now has finished."""
+    return expires - time.time() > (duration or 0) + STREAM_URL_MARGIN + ahead
+
+def invalidate_stream_url(url):
+    stream_url_cache.pop(stream_url_key(url), None)
+
+async def fetch_stream_url(url, priority=PRIORITY_PLAYBACK, guild_id=None):
+    """Resolves a direct stream URL and caches it. Concurrent calls for one video share the request."""
+    key = stream_url_key(url)
+    task = stream_url_fetches.get(key) if key else None
+    if task is None:
+        task = asyncio.create_task(extract_info(url, options=YDL_STREAM_OPTIONS, priority=priority, guild_id=guild_id))
+        if key:
+            stream_url_fetches[key] = task
+            task.add_done_callback(lambda _: stream_url_fetches.pop(key, None))
+    info = await asyncio.shield(task)
+    remember_metadata(info)
+    entry = {"info": info, "expires": stream_url_expiry(info.get('url'))}
+    if key:
+        stream_url_cache[key] = entry
+    return entry
+
+async def get_stream_url(url, priority=PRIORITY_PLAYBACK, guild_id=None):
+    """Returns {"info", "expires"} for a video, from the cache while the URL will outlive the track."""
+    key = stream_url_key(url)
+    entry = stream_url_cache.get(key) if key else None
+    if entry and stream_url_fresh(entry["expires"], entry["info"].get('duration')):
+        stream_url_stats["hits"] += 1
+        return entry
+    stream_url_stats["misses"] += 1
+    return await fetch_stream_url(url, priority, guild_id)
+
+async def refresh_stream_url(url, guild_id):
     try:
-        data = {
-            "uploaded_files_by_guild": uploaded_files_by_guild,
-            "file_tags_by_guild": file_tags_by_guild,
+        await fetch_stream_url(url, PRIORITY_PREFETCH, guild_id)
+    except Exception as e:
+        print(f"[Stream] Could not refresh the stream URL for {url}: {e}")
+
+@tasks.loop(seconds=60)
+async def stream_url_refresher():
+    """Keeps the next few queued songs of streaming guilds resolved, replacing URLs close to expiry."""
+    now = time.time()
+    for key, entry in list(stream_url_cache.items()):
+        if entry["expires"] <= now:
+            del stream_url_cache[key]
+
+    for guild_id, queue in list(song_queue_by_guild.items()):
+        if not is_stream_mode(guild_id):
+            continue
+        for entry in queue.page(0, STREAM_REFRESH_DEPTH):
+            if not isinstance(entry, tuple):
+                continue
+            key = stream_url_key(entry[0])
+            if not key or key in stream_url_fetches:
+                continue
+            cached = stream_url_cache.get(key)
+            if cached and stream_url_fresh(cached["expires"], cached["info"].get('duration'), STREAM_REFRESH_AHEAD):
+                continue
+            stream_url_stats["refreshes"] += 1
+            asyncio.create_task(refresh_stream_url(entry[0], guild_id))
+
+async def resolve_youtube_track(guild_id, url, priority=PRIORITY_PLAYBACK):
+    """Resolves a queued YouTube entry into something FFmpeg can play right away."""
+    cache_key = audio_cache_key(url, AUDIO_CACHE_PROFILE)
+    cached_path = get_cached_audio(cache_key) if cache_key else None
+    if cached_path:
+        cached = get_cached_metadata(url) or {}
+        entry = audio_cache_index[cache_key]
+        if cached_gain_applies(entry) and "gain_db" not in entry:  # Cached before loudness analysis existed
+            asyncio.create_task(measure_cached_loudness(cache_key))
+        pin_cached_audio(cache_key)
+        return {
+            "song_url": cached_path,
+            "duration": cached.get('duration', 0),
+            "ffmpeg_options": FFMPEG_LOCAL_OPTIONS,
+            "acodec": entry.get("acodec"),
+            "gain": gain_factor(entry.get("gain_db")) if cached_gain_applies(entry) else 1.0,
+            "is_temp": False,
+            "cache_key": cache_key,
+            "mode": "cache",
         }
-        with open(SAVE_FILE, "w") as f:
-            json.dump(data, f)
+
+    if is_stream_mode(guild_id):
+        try:
+            stream = await get_stream_url(url, priority, guild_id)
+            info = stream["info"]
+            return {
+                "song_url": info['url'],
+                "duration": info.get('duration', 0),
+                "ffmpeg_options": stream_ffmpeg_options(info),
+                "acodec": info.get('acodec'),
+                "gain": 1.0,  # Streams are never analysed
+                "is_temp": False,
+                "cache_key": None,
+                "expires": stream["expires"],
+                "mode": "stream",
+            }
+        except Exception as e:
+            print(f"[Stream] Could not resolve a direct URL, falling back to download: {e}")
+
+    scratch_folder = os.path.join(DOWNLOAD_SCRATCH_FOLDER, os.urandom(4).hex())
+    try:
+        info = await extract_info(
+            url, download=True, options=YDL_DOWNLOAD_OPTIONS, priority=priority, guild_id=guild_id,
+            download_folder=scratch_folder,
+        )
+        remember_metadata(info)
+        # The mp3 postprocessor rewrites the codec, so only trust acodec for native downloads
+        acodec = info.get('acodec') if OPUS_PASSTHROUGH else "mp3"
+        cache_key = audio_cache_key(url, AUDIO_CACHE_PROFILE)
+        adopted_path = adopt_into_audio_cache(cache_key, info['filepath'], acodec) if cache_key else None
+        if adopted_path:
+            pin_cached_audio(cache_key)
+            song_url = adopted_path
+        else:  # Played once from the downloads folder, then deleted
+            song_url = os.path.join(MUSIC_FOLDER, os.path.basename(info['filepath']))
+            os.replace(info['filepath'], song_url)
+    finally:
+        shutil.rmtree(scratch_folder, ignore_errors=True)
+    return {
+        "song_url": song_url,
+        "duration": info.get('duration', 0),
+        "ffmpeg_options": FFMPEG_LOCAL_OPTIONS,
+        "acodec": acodec,
+        "gain": 1.0,  # Measured in the background for the next time it plays from the cache
+        "is_temp": not adopted_path,
+        "cache_key": cache_key if adopted_path else None,
+        "mode": "download",
+    }
+
+# 🔭 Prefetch — resolve (and download) upcoming YouTube entries while the current song plays
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", "1"))
+PREFETCH_MAX_TRACKS = int(os.getenv("PREFETCH_MAX_TRACKS", "20"))  # Across all guilds
+PREFETCH_MAX_BYTES = int(os.getenv("PREFETCH_MAX_MB", "500")) * 1024 * 1024
+prefetch_by_guild = defaultdict(dict)  # {guild_id: {queue entry: asyncio.Task}}
+
+def prefetched_bytes():
+    total = 0
+    for tasks_by_entry in prefetch_by_guild.values():
+        for task in tasks_by_entry.values():
+            if task.done() and not task.cancelled() and not task.exception():
+                track = task.result()
+                if track["is_temp"] and os.path.exists(track["song_url"]):
+                    total += os.path.getsize(track["song_url"])
+                elif track.get("cache_key") in audio_cache_index:  # Pinned, so the cache can't evict it either
+                    total += audio_cache_index[track["cache_key"]]["size"]
+    return total
+
+def discard_prefetch_task(task):
+    """Cancels a prefetch, or deletes its download if it already finished."""
+    if not task.done():
+        task.cancel()
+        return
+    if task.cancelled() or task.exception():
+        return
+    track = task.result()
+    unpin_cached_audio(track.get("cache_key"))
+    if track["is_temp"] and os.path.exists(track["song_url"]):
+        try:
+            os.remove(track["song_url"])
+        except Exception as e:
+            print(f"[Prefetch] Could not delete unused download: {e}")
+
+def schedule_prefetch(guild_id):
+    """Keeps prefetches in line with the head of the queue.
+
+    Anything that fell out of the lookahead window (shuffle, clear, skip,
+    removal) is cancelled; new entries in the window are started while the
+    disk and track budgets allow.
+    """
+    prefetches = prefetch_by_guild[guild_id]
+    window = [entry for entry in song_queue_by_guild[guild_id].page(0, PREFETCH_DEPTH) if isinstance(entry, tuple)]
+
+    for entry in list(prefetches):
+        if entry not in window:
+            discard_prefetch_task(prefetches.pop(entry))
+
+    for entry in window:
+        if entry in prefetches:
+            continue
+        if sum(len(tasks_by_entry) for tasks_by_entry in prefetch_by_guild.values()) >= PREFETCH_MAX_TRACKS:
+            break
+        if not is_stream_mode(guild_id) and prefetched_bytes() >= PREFETCH_MAX_BYTES:
+            break
+        prefetches[entry] = asyncio.create_task(resolve_youtube_track(guild_id, entry[0], PRIORITY_PREFETCH))
+
+    if not prefetches:
+        prefetch_by_guild.pop(guild_id, None)
+
+def cancel_prefetch(guild_id):
+    for task in prefetch_by_guild.pop(guild_id, {}).values():
+        discard_prefetch_task(task)
+
+async def take_prefetched_track(guild_id, entry):
+    """Returns the prefetched track for `entry`, or None if there isn't a usable one."""
+    task = prefetch_by_guild.get(guild_id, {}).pop(entry, None)
+    if task is None:
+        return None
+    try:
+        # Shielded, so a cancelled resolver (!skip/!stop) raises here instead of looking like a dead prefetch
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if task.cancelled() and not asyncio.current_task().cancelling():
+            return None
+        discard_prefetch_task(task)
+        raise
+    except Exception as e:
+        print(f"[Prefetch] Prefetch failed, resolving again: {e}")
+        return None
+
+# 💾 Write-behind persistence — bursts of saves are coalesced and written off the event loop
+PERSIST_WINDOW = float(os.getenv("PERSIST_WINDOW_SECONDS", "0.5"))
+persister = WriteBehindPersister(window=PERSIST_WINDOW)
+
+# 🗂️ Metadata cache — title/duration/format per video, so repeat lookups skip yt-dlp entirely
+METADATA_CACHE_FILE = "metadata_cache.json"
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL_HOURS", "168")) * 3600
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "5000"))
+METADATA_FIELDS = ("title", "duration", "webpage_url", "format_id", "acodec", "ext")
+YOUTUBE_ID_PATTERN = re.compile(r"(?:youtube\.com/.*[?&]v=|youtu\.be/|youtube\.com/(?:shorts|embed|live)/)([A-Za-z0-9_-]{11})")
+metadata_cache = OrderedDict()  # {"youtube:<id>": {...}}, least recently used first
+metadata_cache_dirty = False
+
+def canonical_video_id(url):
+    """Maps any YouTube watch/short/embed URL to "youtube:<id>", or None if it isn't one."""
+    match = YOUTUBE_ID_PATTERN.search(url or "")
+    return f"youtube:{match.group(1)}" if match else None
+
+def info_cache_key(info):
+    if not info.get('id') or not info.get('extractor_key'):
+        return None
+    return f"{info['extractor_key'].lower()}:{info['id']}"
+
+def get_cached_metadata(url):
+    global metadata_cache_dirty
+    key = canonical_video_id(url)
+    entry = metadata_cache.get(key) if key else None
+    if entry is None:
+        return None
+    if time.time() - entry["cached_at"] > METADATA_CACHE_TTL:
+        del metadata_cache[key]
+        metadata_cache_dirty = True
+        return None
+    metadata_cache.move_to_end(key)
+    return entry
+
+def remember_metadata(info):
+    """Stores a resolved single video's metadata, evicting the least recently used entries."""
+    global metadata_cache_dirty
+    key = info_cache_key(info)
+    if not key or 'entries' in info or not info.get('webpage_url'):
+        return
+    previous = metadata_cache.pop(key, {})
+    entry = {field: info.get(field, previous.get(field)) for field in METADATA_FIELDS}
+    entry["cached_at"] = time.time()
+    metadata_cache[key] = entry
+    while len(metadata_cache) > METADATA_CACHE_SIZE:
+        metadata_cache.popitem(last=False)
+    metadata_cache_dirty = True
+
+def load_metadata_cache():
+    try:
+        with open(METADATA_CACHE_FILE, "r") as f:
+            entries = json.load(f)
+        now = time.time()
+        for key, entry in entries:
+            if now - entry.get("cached_at", 0) <= METADATA_CACHE_TTL:
+                metadata_cache[key] = entry
+        print(f"[Startup] Loaded {len(metadata_cache)} cached track lookups.")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[Load Error] Could not load metadata cache: {e}")
+
+def save_metadata_cache():
+    """Snapshots the cache on the loop and leaves the disk write to the persister."""
+    global metadata_cache_dirty
+    snapshot = list(metadata_cache.items())  # Pairs keep the LRU order
+    persister.submit(write_json_atomic, METADATA_CACHE_FILE, snapshot, key=METADATA_CACHE_FILE, label="metadata cache")
+    metadata_cache_dirty = False
+
+async def lookup_track(url, priority=PRIORITY_METADATA, guild_id=None):
+    """Returns metadata for a single video URL, from the cache when possible."""
+    cached = get_cached_metadata(url)
+    if cached:
+        return cached
+    info = await extract_info(url, priority=priority, guild_id=guild_id)
+    remember_metadata(info)
+    return info
+
+@tasks.loop(seconds=30)
+async def metadata_cache_flusher():
+    if metadata_cache_dirty:
+        save_metadata_cache()
+    if audio_cache_dirty:
+        save_audio_cache_index()
+
+def write_json_atomic(path, data):
+    """Writes JSON to a temp file and renames it over `path`, so a crash never leaves half a file.
+
+    Returns the number of bytes written.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(temp_path, path)
+    return size
+
+# 🔊 Loudness — uploads and cached tracks (except Opus copied as-is) are measured once (EBU R128) and played at a static gain
+LOUDNESS_TARGET_LUFS = float(os.getenv("LOUDNESS_TARGET_LUFS", "-16"))
+LOUDNESS_MAX_GAIN_DB = 12.0
+LOUDNESS_TIMEOUT = 300
+loudness_tasks = {}  # {file path: Task} so a file asked for twice is still only analysed once
+
+def loudness_gain_db(measurement):
+    """Gain that brings a track to the target loudness without pushing its peaks past -1 dBTP."""
+    gain = min(LOUDNESS_TARGET_LUFS - measurement["integrated"], -1.0 - measurement["true_peak"])
+    return round(max(-LOUDNESS_MAX_GAIN_DB, min(LOUDNESS_MAX_GAIN_DB, gain)), 2)
+
+def gain_factor(gain_db):
+    return 10 ** ((gain_db or 0) / 20)
+
+async def measure_loudness_gain(file_path, priority=INGEST_PRIORITY_PROCESS):
+    """Analyses a file in the ingest pool and returns its gain in dB, or None if it can't be measured."""
+    task = loudness_tasks.get(file_path)
+    if task is None:
+        task = loudness_tasks[file_path] = asyncio.create_task(
+            ingest_pool.run("loudness", timeout=LOUDNESS_TIMEOUT, priority=priority, path=file_path)
+        )
+        task.add_done_callback(lambda _: loudness_tasks.pop(file_path, None))
+    try:
+        return loudness_gain_db(await asyncio.shield(task))
     except Exception as e:
-        print(f"[Save Error] Could not save upload data: {e}")
+        print(f"[Loudness] Could not measure {file_path}: {e}")
+        return None
+
+# 💽 Audio cache — finished downloads stay on disk under a byte budget instead of being deleted
+AUDIO_CACHE_FOLDER = os.path.join(MUSIC_FOLDER, "cache")
+AUDIO_CACHE_INDEX = os.path.join(AUDIO_CACHE_FOLDER, "index.json")
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MB", "2048")) * 1024 * 1024
+AUDIO_CACHE_PROFILE = "opus-native" if OPUS_PASSTHROUGH else "mp3-192"  # Which download settings produced the file
+os.makedirs(AUDIO_CACHE_FOLDER, exist_ok=True)
+
+audio_cache_index = {}  # {cache key: {"file", "size", "last_used", "hits", "acodec", "gain_db"}}
+audio_cache_pins = defaultdict(int)  # Entries playing or prefetched are never evicted
+audio_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+audio_cache_dirty = False
+
+def audio_cache_key(url, profile):
+    video_id = canonical_video_id(url)
+    return f"{video_id}:{profile}" if video_id else None
+
+def audio_cache_path(entry):
+    return os.path.join(AUDIO_CACHE_FOLDER, entry["file"])
+
+def get_cached_audio(cache_key):
+    global audio_cache_dirty
+    entry = audio_cache_index.get(cache_key)
+    if entry and os.path.exists(audio_cache_path(entry)):
+        entry["last_used"] = time.time()
+        entry["hits"] += 1
+        audio_cache_stats["hits"] += 1
+        audio_cache_dirty = True
+        return audio_cache_path(entry)
+    if entry:
+        del audio_cache_index[cache_key]
+        audio_cache_dirty = True
+    audio_cache_stats["misses"] += 1
+    return None
+
+def adopt_into_audio_cache(cache_key, file_path, acodec=None):
+    """Moves a fresh download into the cache and returns its new path (or None on failure)."""
+    extension = os.path.splitext(file_path)[1]
+    file_name = hashlib.sha1(cache_key.encode()).hexdigest() + extension
+    try:
+        os.replace(file_path, os.path.join(AUDIO_CACHE_FOLDER, file_name))
+    except OSError as e:
+        print(f"[Audio Cache] Could not cache {file_path}: {e}")
+        return None
+
+    audio_cache_index[cache_key] = {
+        "file": file_name,
+        "size": os.path.getsize(os.path.join(AUDIO_CACHE_FOLDER, file_name)),
+        "last_used": time.time(),
+        "hits": 0,
+        "acodec": acodec,
+    }
+    evict_audio_cache(keep=cache_key)
+    save_audio_cache_index()  # New files are recorded right away so a crash can't orphan them
+    if cached_gain_applies(audio_cache_index[cache_key]):
+        asyncio.create_task(measure_cached_loudness(cache_key))
+    return os.path.join(AUDIO_CACHE_FOLDER, file_name)
+
+def cached_gain_applies(entry):
+    """Native Opus files in passthrough mode keep codec copy, so their gain would never be used."""
+    return not (OPUS_PASSTHROUGH and entry.get("acodec") == "opus")
+
+async def measure_cached_loudness(cache_key):
+    """Stores a cached track's loudness gain. Until it lands the track plays unadjusted."""
+    global audio_cache_dirty
+    entry = audio_cache_index.get(cache_key)
+    if not entry or "gain_db" in entry:
+        return
+    gain_db = await measure_loudness_gain(audio_cache_path(entry), INGEST_PRIORITY_BACKFILL)
+    entry = audio_cache_index.get(cache_key)  # It may have been evicted meanwhile
+    if entry is not None and gain_db is not None:
+        entry["gain_db"] = gain_db
+        audio_cache_dirty = True
+
+def evict_audio_cache(keep=None):
+    """Drops least recently used files until the cache fits its byte budget."""
+    total = sum(entry["size"] for entry in audio_cache_index.values())
+    if total <= AUDIO_CACHE_MAX_BYTES:
+        return
+    for cache_key, entry in sorted(audio_cache_index.items(), key=lambda item: item[1]["last_used"]):
+        if total <= AUDIO_CACHE_MAX_BYTES:
+            break
+        if cache_key == keep or audio_cache_pins.get(cache_key):
+            continue
+        try:
+            os.remove(audio_cache_path(entry))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[Audio Cache] Could not evict {entry['file']}: {e}")
+            continue
+        del audio_cache_index[cache_key]
+        audio_cache_stats["evictions"] += 1
+        total -= entry["size"]
+
+def pin_cached_audio(cache_key):
+    audio_cache_pins[cache_key] += 1
+
+def unpin_cached_audio(cache_key):
+    if not cache_key:
+        return
+    audio_cache_pins[cache_key] -= 1
+    if audio_cache_pins[cache_key] <= 0:
+        del audio_cache_pins[cache_key]
+
+def save_audio_cache_index():
+    global audio_cache_dirty
+    snapshot = {key: dict(entry) for key, entry in audio_cache_index.items()}  # Entries change in place
+    persister.submit(write_json_atomic, AUDIO_CACHE_INDEX, snapshot, key=AUDIO_CACHE_INDEX, label="audio cache index")
+    audio_cache_dirty = False
+
+def load_audio_cache_index():
+    """Loads the index and reconciles it with what is actually on disk."""
+    try:
+        with open(AUDIO_CACHE_INDEX, "r") as f:
+            audio_cache_index.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[Load Error] Could not load audio cache index, starting empty: {e}")
+
+    for cache_key, entry in list(audio_cache_index.items()):
+        if not os.path.exists(audio_cache_path(entry)):
+            del audio_cache_index[cache_key]
+
+    known_files = {entry["file"] for entry in audio_cache_index.values()}
+    for file_name in os.listdir(AUDIO_CACHE_FOLDER):
+        if file_name not in known_files and file_name != os.path.basename(AUDIO_CACHE_INDEX):
+            try:
+                os.remove(os.path.join(AUDIO_CACHE_FOLDER, file_name))
+            except OSError as e:
+                print(f"[Audio Cache] Could not remove stray file {file_name}: {e}")
+
+    evict_audio_cache()
+    save_audio_cache_index()
+    print(f"[Startup] Audio cache holds {len(audio_cache_index)} tracks.")
+
+from collections import defaultdict
+pending_tag_uploads = defaultdict(dict)  # {guild_id: {user_id: [upload IDs]}}
+tag_index_by_guild = defaultdict(TagIndex)  # {guild_id: TagIndex}, kept in sync by every tag edit
+upload_catalog_by_guild = defaultdict(UploadCatalog)  # {guild_id: UploadCatalog}
+upload_ids = itertools.count(1)  # Continues from the store's last ID once uploads are loaded
+song_queue_by_guild = defaultdict(SongQueue)
+last_now_playing_message_by_guild = defaultdict(lambda: None)
+volume_levels_by_guild = defaultdict(lambda: 1.0)
+
+SAVE_FILE = "uploads_data.json"  # Legacy format, migrated into UPLOADS_DB once
+UPLOADS_DB = "echosol.db"
+upload_store = UploadStore(UPLOADS_DB)
+PLAYLISTS_FILE = "playlists.json"  # Legacy format, migrated into UPLOADS_DB once
+playlist_store = PlaylistStore(UPLOADS_DB)
+
+def persist(write, *args):
+    """Hands one row-level store write to the persister; failures are logged there, never raised."""
+    # Lists are copied now, since the caller keeps mutating them while the write waits
+    args = tuple(list(arg) if isinstance(arg, list) else arg for arg in args)
+    persister.submit(write, *args, label="upload data")
 
 def load_upload_data():
+    global upload_ids
     try:
-        with open(SAVE_FILE, "r") as f:
-            data = json.load(f)
-            for guild_id, files in data.get("uploaded_files_by_guild", {}).items():
-                uploaded_files_by_guild[int(guild_id)] = files
-            for guild_id, tags in data.get("file_tags_by_guild", {}).items():
-                file_tags_by_guild[int(guild_id)] = tags
+        if upload_store.migrate_from_json(SAVE_FILE):
+            print("[Startup] Migrated uploads_data.json into the upload database.")
+        uploads, tags = upload_store.load_all()
+        for guild_id, rows in uploads.items():
+            catalog = upload_catalog_by_guild[guild_id] = UploadCatalog()
+            for row in rows:
+                upload = Upload(*row)
+                if upload.path is None:  # Rows from before the catalog only kept a filename
+                    upload.path = os.path.join(MUSIC_FOLDER, upload.filename)
+                    persist(upload_store.update_upload, upload.id, {"path": upload.path})
+                if upload.size is None and os.path.exists(upload.path):
+                    upload.size = os.path.getsize(upload.path)
+                    persist(upload_store.update_upload, upload.id, {"size": upload.size})
+                catalog.add(upload)
+        for guild_id, upload_tags in tags.items():
+            tag_index_by_guild[guild_id] = TagIndex(upload_tags)
+        upload_ids = itertools.count(upload_store.last_upload_id() + 1)
+        upload_blobs.clear()
+        for catalog in upload_catalog_by_guild.values():
+            for upload in catalog:
+                retain_upload_file(upload)
         print("[Startup] Upload data loaded successfully.")
-    except FileNotFoundError:
-        print("[Startup] No saved upload data found. Starting fresh.")
     except Exception as e:
         print(f"[Load Error] Could not load upload data: {e}")
 
-load_upload_data()
+def load_playlists():
+    try:
+        if playlist_store.migrate_from_json(PLAYLISTS_FILE):
+            print("[Startup] Migrated playlists.json into the playlist database.")
+    except Exception as e:
+        print(f"[Load Error] Could not migrate playlists: {e}")
+
+# 🎼 Uploads get a Discord-ready Ogg Opus copy at ingest, so playback can skip the encode
+UPLOAD_OPUS_BITRATE = int(os.getenv("UPLOAD_OPUS_BITRATE", str(OPUS_BITRATE)))
+UPLOAD_KEEP_ORIGINALS = os.getenv("UPLOAD_KEEP_ORIGINALS", "on").lower() in ("1", "true", "yes", "on")
+
+def upload_opus_path(file_path):
+    return file_path + ".opus"
+
+def normalized_opus_path(file_path):
+    return file_path + ".r128.opus"  # Opus copy with the loudness gain already applied
+
+def upload_file_variants(file_path):
+    return (file_path, normalized_opus_path(file_path), upload_opus_path(file_path))
+
+def playable_upload_path(file_path):
+    """Returns (path, acodec, gain applied) for an upload, preferring its normalized Opus copy."""
+    for path, gain_applied in ((normalized_opus_path(file_path), True), (upload_opus_path(file_path), False)):
+        if os.path.exists(path):
+            return path, "opus", gain_applied
+    return file_path, None, False
+
+def remove_upload_files(file_path):
+    """Deletes an upload and its Opus copies. Returns True if anything was removed."""
+    removed = False
+    for path in upload_file_variants(file_path):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+                removed = True
+            except Exception as e:
+                print(f"[Warning] Could not delete {path}: {e}")
+    return removed
+
+def record_upload_gain(file_path, gain_db):
+    """Stores a file's loudness gain on every upload that shares it."""
+    blob = upload_blobs.get(file_path)
+    if blob is None:
+        return
+    blob["gain"] = gain_db
+    for upload in blob["uploads"]:
+        if upload.loudness_gain != gain_db:
+            upload.loudness_gain = gain_db
+            persist(upload_store.update_upload, upload.id, {"loudness_gain": gain_db})
+
+upload_encode_tasks = {}  # {blob path: Task} so a blob shared by several uploads is processed once
+
+async def encode_upload(file_path, priority=INGEST_PRIORITY_PROCESS):
+    """Background ingest job for a blob; concurrent calls for the same file wait on one run."""
+    task = upload_encode_tasks.get(file_path)
+    if task is None:
+        task = upload_encode_tasks[file_path] = asyncio.create_task(process_upload_audio(file_path, priority))
+        task.add_done_callback(lambda _: upload_encode_tasks.pop(file_path, None))
+    await asyncio.shield(task)
+
+async def process_upload_audio(file_path, priority):
+    """Measures loudness, writes the normalized Opus copy and applies the retention setting."""
+    blob = upload_blobs.get(file_path)
+    if blob is None or os.path.exists(normalized_opus_path(file_path)):
+        return
+    if not os.path.exists(file_path):  # Original dropped after an older encode, so only the gain is stored
+        if blob.get("gain") is None and os.path.exists(upload_opus_path(file_path)):
+            gain_db = await measure_loudness_gain(upload_opus_path(file_path), priority)
+            if gain_db is not None:
+                record_upload_gain(file_path, gain_db)
+        return
+
+    gain_db = blob.get("gain")
+    if gain_db is None:
+        gain_db = await measure_loudness_gain(file_path, priority)
+        if gain_db is not None:
+            record_upload_gain(file_path, gain_db)
+    # Unmeasurable files still get a plain Opus copy so playback can skip the encode
+    target = normalized_opus_path(file_path) if gain_db is not None else upload_opus_path(file_path)
+    if file_path not in upload_blobs or os.path.exists(target):  # Released while it was being measured
+        return
+    try:
+        await ingest_pool.run(
+            "encode_opus", priority=priority,
+            source=file_path, target=target, bitrate=UPLOAD_OPUS_BITRATE, gain_db=gain_db,
+        )
+    except Exception as e:
+        print(f"[Ingest] Could not encode {file_path} to Opus, playback will transcode it: {e}")
+        return
+    if file_path not in upload_blobs:  # Its last upload was deleted mid-encode, so nothing will clean up the copy
+        remove_upload_files(file_path)
+        return
+    if target != upload_opus_path(file_path) and os.path.exists(upload_opus_path(file_path)):
+        os.remove(upload_opus_path(file_path))  # Superseded by the normalized copy
+    if not UPLOAD_KEEP_ORIGINALS:
+        try:
+            os.remove(file_path)
+        except Exception as e:
+            print(f"[Ingest] Could not drop original {file_path}: {e}")
+
+async def backfill_upload_encodes():
+    """Probes, measures and encodes existing uploads that predate ingest-time processing. The pool bounds the load."""
+    await adopt_legacy_uploads()
+    await probe_missing_uploads()
+    await asyncio.gather(*(encode_upload(file_path, INGEST_PRIORITY_BACKFILL) for file_path in list(upload_blobs)))
+
+async def probe_upload_file(file_path, priority=INGEST_PRIORITY_UPLOAD):
+    """Runs the probe job on one file. Raises WorkerError if it isn't playable audio."""
+    return await ingest_pool.run("probe", timeout=UPLOAD_PROBE_TIMEOUT, priority=priority, path=file_path)
+
+async def probe_missing_uploads():
+    """Probes uploads stored before ingest-time probing, once per file however many guilds share it."""
+    uploads_by_path = defaultdict(list)
+    for catalog in upload_catalog_by_guild.values():
+        for upload in catalog:
+            if upload.codec is None:
+                uploads_by_path[upload.path].append(upload)
+
+    async def probe_path(file_path, uploads):
+        try:
+            probe = await probe_upload_file(file_path, INGEST_PRIORITY_BACKFILL)
+        except WorkerError as e:
+            print(f"[Ingest] Could not probe {file_path}: {e}")
+            return
+        for upload in uploads:
+            persist(upload_store.update_upload, upload.id, upload.apply_probe(probe))
+
+    await asyncio.gather(*(probe_path(path, uploads) for path, uploads in uploads_by_path.items()))
+
+# 🧬 Shared blobs — identical audio uploaded in several guilds is stored once, by content hash
+BLOB_FOLDER = os.path.join(MUSIC_FOLDER, "blobs")
+BLOB_INCOMING_FOLDER = os.path.join(BLOB_FOLDER, "incoming")
+os.makedirs(BLOB_INCOMING_FOLDER, exist_ok=True)
+upload_blobs = {}  # {file path: {"uploads": records pointing at it, "size": bytes, "gain": loudness dB}}
+
+def blob_path(sha256, extension):
+    folder = os.path.join(BLOB_FOLDER, sha256[:2])
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, sha256 + extension)
+
+def retain_upload_file(upload):
+    blob = upload_blobs.setdefault(upload.path, {"uploads": set(), "size": upload.size or 0, "gain": None})
+    blob["uploads"].add(upload)
+    if blob["gain"] is None:
+        blob["gain"] = upload.loudness_gain
+    elif upload.loudness_gain is None:  # A new record for audio that was already measured
+        upload.loudness_gain = blob["gain"]
+
+def release_upload_file(upload):
+    """Drops one reference to an upload's file; the last one deletes it. Returns True if deleted."""
+    blob = upload_blobs.get(upload.path)
+    if blob:
+        blob["uploads"].discard(upload)
+        if blob["uploads"]:
+            return False
+        del upload_blobs[upload.path]
+    return remove_upload_files(upload.path)
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def move_upload_files(old_path, new_path):
+    """Moves an upload and its Opus copies, or drops them if the destination already has that content."""
+    for source, target in zip(upload_file_variants(old_path), upload_file_variants(new_path)):
+        if not os.path.exists(source):
+            continue
+        if os.path.exists(target):
+            os.remove(source)
+        else:
+            os.replace(source, target)
+
+async def adopt_legacy_uploads():
+    """Moves uploads stored under their filename into the blob store, merging identical files."""
+    uploads_by_path = defaultdict(list)
+    for catalog in upload_catalog_by_guild.values():
+        for upload in catalog:
+            if not upload.path.startswith(BLOB_FOLDER):
+                uploads_by_path[upload.path].append(upload)
+
+    for old_path, uploads in uploads_by_path.items():
+        try:
+            sha256 = await asyncio.to_thread(hash_file, old_path)
+        except OSError as e:
+            print(f"[Blobs] Could not hash {old_path}, leaving it in place: {e}")
+            continue
+        # Deletes and re-uploads may have happened while hashing
+        uploads = [u for u in uploads if u.path == old_path and u.id in upload_catalog_by_guild[u.guild_id]]
+        if not uploads or not os.path.exists(old_path):
+            continue
+
+        new_path = blob_path(sha256, os.path.splitext(old_path)[1])
+        try:
+            move_upload_files(old_path, new_path)
+        except OSError as e:
+            print(f"[Blobs] Could not move {old_path} into the blob store: {e}")
+            continue
+        upload_blobs.pop(old_path, None)
+        for upload in uploads:
+            upload.path = new_path
+            upload.sha256 = sha256
+            retain_upload_file(upload)
+            persist(upload_store.update_upload, upload.id, {"path": new_path, "sha256": sha256})
+    if uploads_by_path:
+        print(f"[Blobs] Moved {len(uploads_by_path)} legacy upload files into the blob store.")
+
+# 📥 Upload ingest — attachments stream to disk in chunks, a few at a time, hashed on the way
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+GUILD_UPLOAD_QUOTA_BYTES = int(os.getenv("GUILD_UPLOAD_QUOTA_MB", "2048")) * 1024 * 1024
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "3"))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_PROBE_TIMEOUT = 60
+upload_slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+upload_reserved_bytes = defaultdict(int)  # {guild_id: bytes still streaming in}, counted against the quota
+
+class UploadRejected(Exception):
+    """An attachment that breaks an upload limit. The message is shown to the uploader."""
+
+def format_size(size):
+    return f"{(size or 0) / (1024 * 1024):.1f} MB"
+
+def format_duration(seconds):
+    seconds = int(seconds or 0)
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60}:{rest % 60:02d}"
+
+async def stream_attachment(session, attachment, target_path):
+    """Streams an attachment to disk in chunks. Returns (bytes written, sha256 hex digest)."""
+    digest = hashlib.sha256()
+    written = 0
+    async with session.get(attachment.url) as response:
+        response.raise_for_status()
+        with open(target_path, "wb") as f:
+            async for chunk in response.content.iter_chunked(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > UPLOAD_MAX_BYTES:  # The declared size isn't trusted on its own
+                    raise UploadRejected(f"larger than {format_size(UPLOAD_MAX_BYTES)}")
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)  # A slow disk mustn't stall every guild
+    return written, digest.hexdigest()
+
+async def ingest_attachment(session, guild_id, user_id, attachment):
+    """Saves one attachment into the guild's catalog and returns its Upload. Raises UploadRejected."""
+    filename = os.path.basename(attachment.filename)
+    catalog = upload_catalog_by_guild[guild_id]
+    if attachment.size > UPLOAD_MAX_BYTES:
+        raise UploadRejected(f"larger than {format_size(UPLOAD_MAX_BYTES)}")
+    existing = catalog.find(filename)
+    replaced_size = (existing.size or 0) if existing else 0
+    if catalog.total_size - replaced_size + upload_reserved_bytes[guild_id] + attachment.size > GUILD_UPLOAD_QUOTA_BYTES:
+        raise UploadRejected(f"this server's {format_size(GUILD_UPLOAD_QUOTA_BYTES)} of upload space is full")
+
+    temp_path = os.path.join(BLOB_INCOMING_FOLDER, f"{os.urandom(8).hex()}.part")
+    upload_reserved_bytes[guild_id] += attachment.size
+    try:
+        async with upload_slots:
+            size, sha256 = await stream_attachment(session, attachment, temp_path)
+        try:  # Broken or non-audio files are turned away here instead of failing mid-queue
+            probe = await probe_upload_file(temp_path)
+        except WorkerError as e:
+            raise UploadRejected(f"doesn’t look like playable audio ({str(e)[:100]})")
+        file_path = blob_path(sha256, os.path.splitext(filename)[1])
+        if not any(os.path.exists(path) for path in upload_file_variants(file_path)):
+            os.replace(temp_path, file_path)  # Otherwise this exact audio is already stored
+    finally:
+        upload_reserved_bytes[guild_id] -= attachment.size
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    upload = catalog.find(filename)  # Looked up again, a same-named upload may have finished meanwhile
+    if upload is None:
+        upload = Upload(
+            next(upload_ids), guild_id, filename, file_path,
+            size=size, added_by=user_id, added_at=time.time(), sha256=sha256
+        )
+        upload.apply_probe(probe)
+        catalog.add(upload)
+        retain_upload_file(upload)
+        persist(upload_store.add_upload, upload.as_row())
+    elif upload.path != file_path:  # A re-upload replaces the content but keeps the ID, tags and queued copies
+        release_upload_file(upload)
+        upload.path = file_path
+        upload.sha256 = sha256
+        upload.loudness_gain = None  # Belonged to the old audio
+        catalog.resize(upload.id, size)
+        retain_upload_file(upload)
+        fields = {
+            "path": file_path, "size": size, "sha256": sha256,
+            "loudness_gain": upload.loudness_gain, **upload.apply_probe(probe),
+        }
+        persist(upload_store.update_upload, upload.id, fields)
+    asyncio.create_task(encode_upload(file_path))
+    return upload
 
 @bot.event
 async def on_message(message):
@@ -236,22 +1296,38 @@ async def on_message(message):
 
     # Handle song uploads with warmth 🎶
     if message.attachments:
-        new_files = []
-        for attachment in message.attachments:
-            if attachment.filename.endswith(('.mp3', '.wav')):
-                file_path = os.path.join(MUSIC_FOLDER, attachment.filename)
-                await attachment.save(file_path)
-                uploaded_files_by_guild[guild_id].append(attachment.filename)
-                new_files.append(attachment.filename)
-
-        if new_files:
-            pending_tag_uploads[guild_id][user_id] = new_files
+        audio_attachments = [a for a in message.attachments if a.filename.endswith(('.mp3', '.wav'))]
+        if not audio_attachments:
+            return
+
+        async with aiohttp.ClientSession() as session:
+            results = await asyncio.gather(
+                *(ingest_attachment(session, guild_id, user_id, attachment) for attachment in audio_attachments),
+                return_exceptions=True
+            )
+
+        new_uploads = []
+        report = []
+        for attachment, result in zip(audio_attachments, results):
+            if isinstance(result, Upload):
+                new_uploads.append(result)
+                report.append(f"✅ `{result.filename}` — {format_size(result.size)}")
+            elif isinstance(result, UploadRejected):
+                report.append(f"⚠️ `{attachment.filename}` — skipped: {result}")
+            else:
+                print(f"[Upload] Could not save {attachment.filename}: {result}")
+                report.append(f"⚠️ `{attachment.filename}` — couldn’t be saved, please try again")
+
+        if new_uploads:
+            pending_tag_uploads[guild_id][user_id] = [upload.id for upload in new_uploads]
             await message.channel.send(
                 f"{form_data.get('upload_message', '🌟 Thanks for sharing your musical light! 🌈')}\n"
-                f"🎵 Uploaded: **{', '.join(new_files)}**\n"
+                f"🎵 Uploaded: **{', '.join(upload.filename for upload in new_uploads)}**\n"
+                + "\n".join(report) + "\n"
                 f"💫 {form_data.get('tag_prompt', 'Please reply with tags (e.g. `chill`, `sunset`, `epic`) — spaces or commas are fine!')}"
             )
-            save_upload_data()
+        else:
+            await message.channel.send("\n".join(report))
         return
 
     # Handle tag replies with gentle guidance 💖
@@ -269,10 +1345,9 @@ async def on_message(message):
             await message.channel.send(form_data.get('tag_none_found', "⚠️ Oops! No tags found. Try again with some beautiful labels 🌻"))
             return
 
-        for filename in pending_tag_uploads[guild_id][user_id]:
-            if filename not in file_tags_by_guild[guild_id]:
-                file_tags_by_guild[guild_id][filename] = []
-            file_tags_by_guild[guild_id][filename].extend(tags)
+        for upload_id in pending_tag_uploads[guild_id][user_id]:
+            tag_index_by_guild[guild_id].add(upload_id, tags)
+        persist(upload_store.add_tags, pending_tag_uploads[guild_id][user_id], tags)
 
         await message.channel.send(
             f"{form_data.get('tag_success_reply', '🏷️ Your sound sparkles have been tagged! ✨')}\n"
@@ -280,7 +1355,6 @@ async def on_message(message):
         )
 
         del pending_tag_uploads[guild_id][user_id]
-        save_upload_data()
 
 
 # 🌸 Seasonal Flavor Helper 🌞🍂❄️
@@ -328,6 +1402,13 @@ async def on_ready():
     global previous_echo_form
     previous_echo_form = None
     seasonal_heartbeat.start()
+    if not metadata_cache_flusher.is_running():
+        metadata_cache_flusher.start()
+    if not progress_scheduler.is_running():
+        progress_scheduler.start()
+    if not stream_url_refresher.is_running():
+        stream_url_refresher.start()
+    asyncio.create_task(backfill_upload_encodes())
 
 async def announce_echo_form_shift(new_form: str):
     # Customize form names and style here
@@ -829,6 +1910,139 @@ def get_seasonal_form_data():
     form = get_current_form()
     return SEASONAL_FORMS.get(form, SEASONAL_FORMS["default"])
 
+# ⏳ Progress scheduler — one loop drives every guild's now-playing bar.
+# Elapsed time comes from the start timestamp, edits are spread over slots,
+# capped per channel and globally, and slowed down when the event loop lags.
+PROGRESS_TICK = 1.0
+PROGRESS_BASE_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "5"))
+PROGRESS_MAX_INTERVAL = 60.0
+PROGRESS_CHANNEL_MIN_INTERVAL = 2.5  # Discord allows ~5 message edits per 5s per channel
+PROGRESS_GLOBAL_EDITS_PER_TICK = int(os.getenv("PROGRESS_EDITS_PER_SECOND", "10"))
+PROGRESS_LAG_THRESHOLD = 0.25  # Seconds of tick lateness that count as a lagging loop
+PROGRESS_FINALE_HOLD = 6.0
+
+progress_by_guild = {}  # {guild_id: now-playing state}
+last_progress_edit_by_channel = {}  # {channel_id: monotonic time}, only while it still limits the channel
+progress_state = {"interval": PROGRESS_BASE_INTERVAL, "lag": 0.0, "last_tick": None, "edits": 0, "deferred": 0}
+
+def seasonal_progress_bar(form_data, current, total, segments=10):
+    """Seasonal progress bar (fixed for custom emoji handling)."""
+    filled = int((current / total) * segments) if total > 0 else 0
+    emojis = form_data["bar_emojis"]
+    filled_icon = emojis[0]
+    pulse_icon = emojis[1] if len(emojis) > 1 else filled_icon  # fallback if only 1 emoji
+    unfilled_icon = form_data.get("unfilled", "▫️")
+    return ''.join(
+        f"{filled_icon}" if i < filled else f"{pulse_icon}" if i == filled else f"{unfilled_icon}"
+        for i in range(segments)
+    )
+
+def progress_field_value(form_data, second, duration):
+    timestamp = f"{second // 60}:{second % 60:02d} / {duration // 60}:{duration % 60:02d}"
+    return f"{seasonal_progress_bar(form_data, second, duration)} `{timestamp}`"
+
+def start_progress(guild_id, message, embed, form_data, song_title, duration):
+    now = time.monotonic()
+    progress_by_guild[guild_id] = {
+        "message": message,
+        "embed": embed,
+        "form_data": form_data,
+        "title": song_title,
+        "duration": duration,
+        "started_at": now,
+        "paused_at": None,
+        "paused_total": 0.0,
+        # Stagger guilds across slots so their edits don't all land on the same tick
+        "next_edit_at": now + (guild_id % int(PROGRESS_BASE_INTERVAL or 1)) + 1,
+        "finished_at": None,
+    }
+
+def stop_progress(guild_id, entry=None):
+    """Stops the guild's bar, or only `entry` if given, so a newer song's bar is left alone."""
+    if entry is None or progress_by_guild.get(guild_id) is entry:
+        progress_by_guild.pop(guild_id, None)
+
+def pause_progress(guild_id):
+    entry = progress_by_guild.get(guild_id)
+    if entry and entry["paused_at"] is None:
+        entry["paused_at"] = time.monotonic()
+
+def resume_progress(guild_id):
+    entry = progress_by_guild.get(guild_id)
+    if entry and entry["paused_at"] is not None:
+        entry["paused_total"] += time.monotonic() - entry["paused_at"]
+        entry["paused_at"] = None
+
+def progress_elapsed(entry, now):
+    paused_since = entry["paused_at"] or now
+    return int(paused_since - entry["started_at"] - entry["paused_total"])
+
+async def send_progress_edit(guild_id, entry, now):
+    embed = entry["embed"]
+    form_data = entry["form_data"]
+    duration = entry["duration"]
+    elapsed = progress_elapsed(entry, now)
+
+    if entry["finished_at"] is not None:
+        embed.set_field_at(0, name="Progress", value="🌙 The glow fades gently... `Complete`", inline=False)
+        stop_progress(guild_id, entry)
+    elif elapsed >= duration:
+        embed.title = form_data.get("finale_title", "🌟 Finale Glow")
+        embed.description = form_data.get("finale_desc", "**{song}** just finished playing.").format(song=entry["title"])
+        finale_bar = form_data.get("finale_bar", "✨")
+        embed.set_field_at(0, name="Progress", value=f"{finale_bar * 10} `Finished`", inline=False)
+        entry["finished_at"] = now
+        entry["next_edit_at"] = now + PROGRESS_FINALE_HOLD
+    else:
+        embed.set_field_at(0, name="Progress", value=progress_field_value(form_data, elapsed, duration), inline=False)
+        entry["next_edit_at"] = now + progress_state["interval"]
+
+    try:
+        await entry["message"].edit(embed=embed)
+    except discord.HTTPException:
+        pass
+
+@tasks.loop(seconds=PROGRESS_TICK)
+async def progress_scheduler():
+    now = time.monotonic()
+    if progress_state["last_tick"] is not None:
+        lag = max(0.0, now - progress_state["last_tick"] - PROGRESS_TICK)
+        progress_state["lag"] = lag
+        if lag > PROGRESS_LAG_THRESHOLD:
+            progress_state["interval"] = min(PROGRESS_MAX_INTERVAL, progress_state["interval"] * 2)
+        else:
+            progress_state["interval"] = max(PROGRESS_BASE_INTERVAL, progress_state["interval"] - 1)
+    progress_state["last_tick"] = now
+
+    # Channels past their min interval are no longer limited, so stopped bars don't leave entries behind
+    for channel_id, edited_at in list(last_progress_edit_by_channel.items()):
+        if now - edited_at >= PROGRESS_CHANNEL_MIN_INTERVAL:
+            del last_progress_edit_by_channel[channel_id]
+
+    due = []
+    for guild_id, entry in progress_by_guild.items():
+        if entry["paused_at"] is not None or now < entry["next_edit_at"]:
+            continue
+        # Finales land on time even between slots; regular updates wait for their slot
+        if entry["finished_at"] is None and progress_elapsed(entry, now) >= entry["duration"]:
+            entry["next_edit_at"] = now
+        due.append((entry["next_edit_at"], guild_id, entry))
+    due.sort(key=lambda item: item[0])  # Most overdue first
+
+    batch = []
+    for _, guild_id, entry in due:
+        channel_id = entry["message"].channel.id
+        if len(batch) >= PROGRESS_GLOBAL_EDITS_PER_TICK or \
+                now - last_progress_edit_by_channel.get(channel_id, 0) < PROGRESS_CHANNEL_MIN_INTERVAL:
+            progress_state["deferred"] += 1
+            continue
+        last_progress_edit_by_channel[channel_id] = now
+        batch.append(send_progress_edit(guild_id, entry, now))
+
+    if batch:
+        progress_state["edits"] += len(batch)
+        await asyncio.gather(*batch)
+
 @bot.command(aliases=["playwithme", "connect", "verbinden", "kisses"])
 async def join(ctx):
     """Joins a voice channel, seasonally flavored."""
@@ -848,10 +2062,116 @@ async def leave(ctx):
 
     if ctx.voice_client:
         await ctx.voice_client.disconnect()
+        stop_progress(ctx.guild.id)  # Nothing is playing any more, so the bar must not keep ticking
         await ctx.send(form_data.get("leave_message", "🌅 Echosol has gently drifted from the voice channel, returning to the cosmos. 💫"))
     else:
         await ctx.send("🌙 I'm not shining in any voice channel right now.")
 
+# 📜 Playlist loading — big playlists are read a page at a time while the first songs already play
+PLAYLIST_PAGE_SIZE = 50
+PLAYLIST_PROGRESS_INTERVAL = 3  # Seconds between edits of the progress message
+MAX_QUEUE_LENGTH = int(os.getenv("MAX_QUEUE_LENGTH", "1000"))  # Entries per guild; a page/tag/all-uploads block is one
+QUEUE_FULL_MESSAGE = f"🚧 The queue is full ({MAX_QUEUE_LENGTH} entries) — let a few play first."
+playlist_loaders_by_guild = defaultdict(set)  # {guild_id: running loader tasks}, cancelled by stop/clearqueue
+
+def enqueue(guild_id, items, index=None):
+    """Adds entries to a guild's queue (at `index`, or the end) until it holds MAX_QUEUE_LENGTH.
+
+    Every command that queues songs goes through here. Returns how many entries fit.
+    """
+    queue = song_queue_by_guild[guild_id]
+    items = list(items)[:max(MAX_QUEUE_LENGTH - len(queue), 0)]
+    if index is None:
+        queue.extend(items)
+    else:
+        for offset, item in enumerate(items):
+            queue.insert(index + offset, item)
+    return len(items)
+
+def playlist_page(start):
+    return f"{start}-{start + PLAYLIST_PAGE_SIZE - 1}"
+
+async def iter_playlist_entries(guild_id, url, first_page):
+    """Yields (url, title) placeholders for a playlist, fetching the next page only when needed."""
+    info, start = first_page, 1
+    while True:
+        entries = info.get('entries') or []
+        for entry in entries:
+            entry_url = entry and (entry.get('webpage_url') or entry.get('url'))
+            if not entry_url:  # Private or deleted videos come back empty
+                continue
+            if entry.get('_type') != 'url':  # Some extractors return full entries even when flat
+                remember_metadata(entry)
+            # Resolved by prefetch or when it reaches the head of the queue
+            yield entry_url, entry.get('title') or entry_url
+        if len(entries) < PLAYLIST_PAGE_SIZE:
+            return
+        start += PLAYLIST_PAGE_SIZE
+        info = await extract_info(
+            url, options=YDL_FLAT_OPTIONS, playlist_items=playlist_page(start),
+            priority=PRIORITY_PLAYLIST, guild_id=guild_id,
+        )
+
+async def load_playlist(ctx, url, first_page):
+    """Appends a playlist to the queue as its pages arrive, starting playback with the first entry."""
+    guild_id = ctx.guild.id
+    form_data = get_seasonal_form_data()
+    total = first_page.get('playlist_count') or "?"
+    progress_text = form_data.get("playlist_progress_message", "📜 {count}/{total} queued…")
+    progress = await ctx.send(progress_text.format(count=0, total=total))
+    added = 0
+    last_update = time.monotonic()
+    note = ""
+
+    async def show(text):
+        try:
+            await progress.edit(content=text)
+        except discord.HTTPException:
+            pass
+
+    try:
+        async for item in iter_playlist_entries(guild_id, url, first_page):
+            if not enqueue(guild_id, [item]):
+                note = f"\n🚧 The queue is full ({MAX_QUEUE_LENGTH} entries), the rest of the playlist was left out."
+                break
+            added += 1
+            if added == 1:
+                get_player(guild_id).submit("play", ctx)  # No-op if something is already playing
+            if time.monotonic() - last_update >= PLAYLIST_PROGRESS_INTERVAL:
+                last_update = time.monotonic()
+                schedule_prefetch(guild_id)
+                await show(progress_text.format(count=added, total=total))
+    except asyncio.CancelledError:
+        await show(f"⏹️ Stopped loading the playlist after {added} songs.")
+        raise
+    except Exception as e:
+        note = f"\n⚠️ The rest of the playlist couldn't be read: `{e}`"
+
+    schedule_prefetch(guild_id)
+    await show(form_data["playlist_add_message"].format(count=added) + note)
+
+async def lookup_play_target(guild_id, url):
+    """Metadata for a !play URL: a single video, or the first page of a flat playlist."""
+    return get_cached_metadata(url) or await extract_info(
+        url, options=YDL_FLAT_OPTIONS, playlist_items=playlist_page(1), guild_id=guild_id
+    )
+
+async def leave_if_idle(ctx):
+    """Disconnects a voice client that was joined for a !play that then failed."""
+    vc = ctx.voice_client
+    if vc and not (vc.is_playing() or vc.is_paused()) and not song_queue_by_guild[ctx.guild.id]:
+        await vc.disconnect()
+
+def start_playlist_loader(ctx, url, first_page):
+    loaders = playlist_loaders_by_guild[ctx.guild.id]
+    task = asyncio.create_task(load_playlist(ctx, url, first_page))
+    loaders.add(task)
+    task.add_done_callback(loaders.discard)
+
+def cancel_playlist_loaders(guild_id):
+    for task in playlist_loaders_by_guild.pop(guild_id, set()):
+        task.cancel()
+
 @bot.command(aliases=["p", "gimme", "spielen"])
 async def play(ctx, url: str = None):
     """Plays a song from YouTube or adds it to the queue with seasonal flavor."""
@@ -862,168 +2182,366 @@ async def play(ctx, url: str = None):
         await ctx.send(form_data["no_url_message"])
         return
 
-    connected = await connect_to_voice(ctx)
-    if not connected:
-        return
-    else:
-        await ctx.send(form_data["connected_message"])
+    vc = ctx.voice_client
+    if not (vc and (vc.is_playing() or vc.is_paused())):
+        play_requested_at[guild_id] = time.monotonic()
+
+    # The voice handshake and the lookup are independent round-trips, so they run side by side
+    lookup = asyncio.create_task(lookup_play_target(guild_id, url))
+    connect = None if vc else asyncio.create_task(connect_to_voice(ctx))
+    if connect:
+        await asyncio.wait({lookup, connect}, return_when=asyncio.FIRST_COMPLETED)
+        if connect.done() and not connect.result():  # Nowhere to play, so drop the lookup
+            lookup.cancel()
+            play_requested_at.pop(guild_id, None)
+            return
 
     try:
-        with youtube_dl.YoutubeDL(YDL_OPTIONS) as ydl:
-            info = ydl.extract_info(url, download=False)
-
-            if 'entries' in info:  # Playlist
-                added = 0
-                for entry in info['entries']:
-                    if entry:
-                        if '_type' in entry and entry['_type'] == 'url':
-                            entry_info = ydl.extract_info(entry['url'], download=False)
-                        else:
-                            entry_info = entry
-                        song_queue_by_guild[guild_id].append((entry_info['webpage_url'], entry_info['title']))
-                        added += 1
-                await ctx.send(form_data["playlist_add_message"].format(count=added))
-            else:  # Single video
-                song_queue_by_guild[guild_id].append((info['webpage_url'], info['title']))
-                await ctx.send(form_data["single_add_message"].format(title=info['title']))
-
+        info = await lookup
+        remember_metadata(info)
     except Exception as e:
+        if connect and await connect:
+            await leave_if_idle(ctx)
+        play_requested_at.pop(guild_id, None)
         await ctx.send(f"⚠️ A cloud blocked the song: `{e}`")
         return
 
+    entry = None
+    if 'entries' not in info:
+        entry = (info['webpage_url'], info['title'])
+        if not enqueue(guild_id, [entry]):
+            if connect and await connect:
+                await leave_if_idle(ctx)
+            play_requested_at.pop(guild_id, None)
+            await ctx.send(QUEUE_FULL_MESSAGE)
+            return
+        schedule_prefetch(guild_id)  # Starts resolving the audio while the handshake finishes
+
+    if connect:
+        if not await connect:
+            queue = song_queue_by_guild[guild_id]
+            if entry is not None and queue and queue[-1] == entry:
+                queue.pop()
+                schedule_prefetch(guild_id)
+            play_requested_at.pop(guild_id, None)
+            return
+        await ctx.send(form_data["connected_message"])
+
+    if entry is None:  # Playlist: queued and started in the background
+        start_playlist_loader(ctx, url, info)
+        return
+    await ctx.send(form_data["single_add_message"].format(title=info['title']))
+
     if not ctx.voice_client.is_playing():
         await play_next(ctx)
+    else:
+        schedule_prefetch(guild_id)
+
+class GuildPlayer:
+    """Owns one guild's playback as a single long-lived task.
+
+    Every command that can change the current track (play, skip, stop, volume,
+    shuffle and track-end events from the voice thread) goes through one
+    asyncio queue and is handled quickly. Resolving the next entry, which can
+    take as long as a download, runs in a task the player owns, so stop and
+    skip can cancel it; only its result, a "start" command, begins playback.
+    Each started track gets a token; a track-end event for any other token is
+    stale and ignored, and so is a "start" from a cancelled resolve, which
+    makes exactly one advance happen per track end.
+    """
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.commands = asyncio.Queue()
+        self.ctx = None
+        self.track = None
+        self.track_token = 0
+        self.resolving = None  # Task looking up the next entry, if any
+        self.resolve_token = 0
+        self.retried_entry = None  # A stream that already got its one re-resolve after failing early
+        self.task = asyncio.create_task(self._run())
+
+    def submit(self, command, ctx=None, *args):
+        """Queues a command without waiting for it (safe to call via call_soon_threadsafe)."""
+        self.commands.put_nowait((command, ctx, args, None))
+
+    async def send(self, command, ctx=None, *args):
+        """Queues a command and waits until the player has handled it."""
+        done = asyncio.get_running_loop().create_future()
+        self.commands.put_nowait((command, ctx, args, done))
+        return await done
+
+    async def _run(self):
+        while True:
+            command, ctx, args, done = await self.commands.get()
+            if ctx is not None:
+                self.ctx = ctx
+            try:
+                result = await getattr(self, f"_handle_{command}")(*args)
+            except Exception as e:
+                print(f"[Player] {command} failed in guild {self.guild_id}: {e}")
+                if done and not done.done():
+                    done.set_exception(e)
+            else:
+                if done and not done.done():
+                    done.set_result(result)
+
+    @property
+    def voice_client(self):
+        return self.ctx.voice_client if self.ctx else None
+
+    def _is_busy(self):
+        vc = self.voice_client
+        return bool(vc and (vc.is_playing() or vc.is_paused()))
+
+    def _interrupt(self):
+        """Stops the current track (or the lookup of the next one) without triggering an advance."""
+        self._cancel_resolve()
+        self.track_token += 1
+        if self.voice_client and self._is_busy():
+            self.voice_client.stop()
+        self._release_track()
+
+    def _release_track(self):
+        track, self.track = self.track, None
+        if track:
+            self._discard(track)
+
+    @staticmethod
+    def _discard(track):
+        """Deletes a track's temporary download and unpins its cache entry."""
+        if track["is_temp"] and os.path.exists(track["song_url"]):
+            try:
+                os.remove(track["song_url"])
+            except Exception as e:
+                print(f"[Cleanup Error] Could not delete file: {e}")
+        unpin_cached_audio(track.get("cache_key"))
 
-async def play_next(ctx):
-    guild_id = ctx.guild.id
-    vc = ctx.voice_client
-    form_data = get_seasonal_form_data()
+    def _cancel_resolve(self):
+        self.resolve_token += 1  # A result that is already on its way gets dropped as stale
+        if self.resolving and not self.resolving.done():
+            self.resolving.cancel()
+        self.resolving = None
 
-    if vc and vc.is_playing():
-        return
+    def _is_resolving(self):
+        return bool(self.resolving and not self.resolving.done())
 
-    if not song_queue_by_guild[guild_id]:
-        await ctx.send(form_data.get("queue_empty_message", "🌈 The stage awaits new tunes!"))
-        return
+    async def _handle_play(self):
+        if not self._is_busy() and not self._is_resolving():
+            self._advance()
 
-    usage_counters[guild_id] += 1
-    is_high_usage = usage_counters[guild_id] >= 30
+    async def _handle_track_end(self, token, error):
+        if error:
+            print(f"⚠️ Playback error: {error}")
+        if token != self.track_token:
+            return
+        track = self.track
+        self._release_track()
+        if self._failed_early(track):
+            # Most likely an expired or rejected URL: resolve it again and give it one more go
+            self.retried_entry = track["entry"]
+            invalidate_stream_url(track["entry"][0])
+            song_queue_by_guild[self.guild_id].insert(0, track["entry"])
+            stream_url_stats["retries"] += 1
+            print(f"[Stream] {track['title']} stopped after a few seconds, retrying with a fresh URL")
+        self._advance()
+
+    def _failed_early(self, track):
+        return (
+            track is not None and track["mode"] == "stream" and track["entry"] != self.retried_entry
+            and time.monotonic() - track["started_at"] < STREAM_EARLY_FAILURE_SECONDS
+            and (track["duration"] or 0) > 2 * STREAM_EARLY_FAILURE_SECONDS
+        )
 
-    if last_now_playing_message_by_guild.get(guild_id):
-        try:
-            embed = last_now_playing_message_by_guild[guild_id].embeds[0]
-            embed.set_field_at(0, name="Progress", value="💤 This song has finished playing. `Complete`", inline=False)
-            await last_now_playing_message_by_guild[guild_id].edit(embed=embed)
-        except Exception:
-            pass
-        last_now_playing_message_by_guild[guild_id] = None
+    async def _handle_skip(self):
+        if not self._is_busy() and not self._is_resolving():
+            return False
+        self._interrupt()
+        self._advance()
+        return True
+
+    async def _handle_stop(self):
+        was_playing = self._is_busy() or self._is_resolving()
+        song_queue_by_guild[self.guild_id].clear()
+        cancel_playlist_loaders(self.guild_id)
+        cancel_prefetch(self.guild_id)
+        stop_progress(self.guild_id)
+        self._interrupt()
+        return was_playing
+
+    async def _handle_volume(self, level):
+        volume_levels_by_guild[self.guild_id] = level
+        source = self.voice_client.source if self.voice_client else None
+        if isinstance(source, discord.PCMVolumeTransformer):
+            source.volume = level * (self.track or {}).get("gain", 1.0)
+            return True
+        return source is None  # False means the change waits for the next song
+
+    async def _handle_shuffle(self):
+        queue = song_queue_by_guild[self.guild_id]
+        if queue.song_count() <= 1:
+            return False
+        queue.shuffle()
+        schedule_prefetch(self.guild_id)
+        return True
+
+    async def _resolve(self, song_data):
+        """Turns a queue entry into a playable track dict. Raises if it can't be fetched."""
+        if isinstance(song_data, tuple):
+            original_url, song_title = song_data
+            track = await take_prefetched_track(self.guild_id, song_data)
+            if track and track["mode"] == "stream" and not stream_url_fresh(track["expires"], track["duration"]):
+                track = None  # Prefetched too long ago, the URL would expire mid-song
+            if track is None:
+                track = await resolve_youtube_track(self.guild_id, original_url)
+            return {**track, "title": song_title, "entry": song_data}
+
+        upload = upload_catalog_by_guild[self.guild_id].get(song_data)
+        if upload is None:
+            raise LookupError(f"upload #{song_data} has been deleted")
+        song_url, acodec, gain_applied = playable_upload_path(upload.path)
+        return {
+            "song_url": song_url,
+            "title": upload.filename,
+            "duration": int(upload.duration or 0),  # Probed at ingest; 0 just hides the progress bar
+            "ffmpeg_options": FFMPEG_LOCAL_OPTIONS,
+            "acodec": acodec,
+            "gain": 1.0 if gain_applied else gain_factor(upload.loudness_gain),
+            "entry": song_data,
+            "is_temp": False,
+            "cache_key": None,
+            "mode": "local",
+        }
 
-    song_data = song_queue_by_guild[guild_id].pop(0)
-    is_temp_youtube = False
+    def _advance(self):
+        """Starts looking up the next playable entry in the background."""
+        self._cancel_resolve()
+        self.resolving = asyncio.create_task(self._resolve_next(self.resolve_token))
 
-    if isinstance(song_data, tuple):
-        original_url, song_title = song_data
-        try:
-            with youtube_dl.YoutubeDL(YDL_OPTIONS) as ydl:
-                info = ydl.extract_info(original_url, download=True)
-                song_url = info['requested_downloads'][0]['filepath'] if 'requested_downloads' in info else ydl.prepare_filename(info)
-                duration = info.get('duration', 0)
-                is_temp_youtube = True
-        except Exception as e:
-            await ctx.send(f"⚠️ Could not fetch audio: {e}\nSkipping to next song...")
-            return await play_next(ctx)
-        ffmpeg_options = FFMPEG_LOCAL_OPTIONS
-    else:
-        song_url = song_data
-        song_title = os.path.basename(song_url)
-        try:
-            audio = MP3(song_url) if song_url.endswith(".mp3") else WAVE(song_url)
-            duration = int(audio.info.length) if audio and audio.info else 0
-        except Exception:
-            duration = 0
-        ffmpeg_options = FFMPEG_LOCAL_OPTIONS
+    async def _resolve_next(self, token):
+        """Resolves entries until one works, then hands it to the player. Failed entries are skipped in a loop."""
+        guild_id = self.guild_id
+        ctx = self.ctx
+        form_data = get_seasonal_form_data()
 
-    def after_play(error):
-        if error:
-            print(f"⚠️ Playback error: {error}")
-        if is_temp_youtube and os.path.exists(song_url):
+        if not song_queue_by_guild[guild_id]:
+            await ctx.send(form_data.get("queue_empty_message", "🌈 The stage awaits new tunes!"))
+            return
+
+        stop_progress(guild_id)
+        if last_now_playing_message_by_guild.get(guild_id):
+            try:
+                embed = last_now_playing_message_by_guild[guild_id].embeds[0]
+                embed.set_field_at(0, name="Progress", value="💤 This song has finished playing. `Complete`", inline=False)
+                await last_now_playing_message_by_guild[guild_id].edit(embed=embed)
+            except Exception:
+                pass
+            last_now_playing_message_by_guild[guild_id] = None
+
+        track = None
+        while track is None and song_queue_by_guild[guild_id]:
+            try:
+                song_data = song_queue_by_guild[guild_id].pop_next()
+            except IndexError:  # Only exhausted segments were left
+                break
+            resolve_started = time.monotonic()
             try:
-                os.remove(song_url)
+                track = await self._resolve(song_data)
             except Exception as e:
-                print(f"[Cleanup Error] Could not delete file: {e}")
-        asyncio.run_coroutine_threadsafe(play_next(ctx), bot.loop)
-
-    vc.play(discord.FFmpegPCMAudio(song_url, **ffmpeg_options), after=after_play)
-    vc.source = discord.PCMVolumeTransformer(vc.source, volume_levels_by_guild[guild_id])
-
-    # Seasonal progress bar (fixed for custom emoji handling)
-    def seasonal_progress_bar(current, total, segments=10):
-        filled = int((current / total) * segments) if total > 0 else 0
-        emojis = form_data["bar_emojis"]
-        filled_icon = emojis[0]
-        pulse_icon = emojis[1] if len(emojis) > 1 else filled_icon  # fallback if only 1 emoji
-        unfilled_icon = form_data.get("unfilled", "▫️")
-        return ''.join(
-            f"{filled_icon}" if i < filled else f"{pulse_icon}" if i == filled else f"{unfilled_icon}"
-            for i in range(segments)
-        )
+                await ctx.send(f"⚠️ Could not fetch audio: {e}\nSkipping to next song...")
 
-    progress_bar_func = seasonal_progress_bar
+        if track is None:
+            await ctx.send(form_data.get("queue_empty_message", "🌈 The stage awaits new tunes!"))
+            return
+        track["resolve_started"] = resolve_started
+        self.submit("start", None, token, track)
+
+    async def _handle_start(self, token, track):
+        """Plays a resolved track, unless stop or skip has cancelled its lookup meanwhile."""
+        guild_id = self.guild_id
+        ctx = self.ctx
+        form_data = get_seasonal_form_data()
+
+        vc = self.voice_client
+        if token != self.resolve_token or not vc or not vc.is_connected():
+            self._discard(track)
+            return
+        self.resolving = None
 
-    embed = discord.Embed(
-        title=form_data["name"],
-        description=form_data.get("start_desc", f"🎶 **{song_title}** is playing!").format(song=song_title),
-        color=form_data["color"]
-    )
+        self.track_token += 1
+        self.track = track
+        token = self.track_token
 
-    if duration:
-        embed.add_field(name="Progress", value=f"{progress_bar_func(0, duration)} `0:00 / {duration // 60}:{duration % 60:02d}`", inline=False)
+        def after_play(error):
+            bot.loop.call_soon_threadsafe(self.submit, "track_end", None, token, error)
 
-    message = await ctx.send(embed=embed)
-    last_now_playing_message_by_guild[guild_id] = message
+        volume = volume_levels_by_guild[guild_id] * track.get("gain", 1.0)
+        vc.play(make_audio_source(track["song_url"], track["ffmpeg_options"], track["acodec"], volume), after=after_play)
+        track["started_at"] = time.monotonic()
+        if track["entry"] != self.retried_entry:
+            self.retried_entry = None
 
-    if duration and not is_high_usage:
-        for second in range(1, duration + 1):
-            bar = progress_bar_func(second, duration, pulse_state=second)
-            timestamp = f"{second // 60}:{second % 60:02d} / {duration // 60}:{duration % 60:02d}"
+        if track["mode"] != "local":
+            record_start_latency(track["mode"], time.monotonic() - track["resolve_started"], track["duration"])
+        requested_at = play_requested_at.pop(guild_id, None)
+        if requested_at is not None:
+            seconds = time.monotonic() - requested_at
+            play_command_latency.append((seconds, track["duration"] or 0))
+            print(f"[Latency] !play to first audio took {seconds:.2f}s")
 
-            if second % 5 == 0 or second == duration:
-                try:
-                    embed.set_field_at(0, name="Progress", value=f"{bar} `{timestamp}`", inline=False)
-                    await message.edit(embed=embed)
-                except discord.HTTPException:
-                    pass
+        schedule_prefetch(guild_id)
 
-            await asyncio.sleep(1)
+        song_title = track["title"]
+        duration = int(track["duration"] or 0)
+        embed = discord.Embed(
+            title=form_data["name"],
+            description=form_data.get("start_desc", f"🎶 **{song_title}** is playing!").format(song=song_title),
+            color=form_data["color"]
+        )
 
-        try:
-            embed.title = form_data.get("finale_title", "🌟 Finale Glow")
-            embed.description = form_data.get("finale_desc", "**{song}** just finished playing.").format(song=song_title)
-            finale_bar = form_data.get("finale_bar", "✨")
-            embed.set_field_at(0, name="Progress", value=f"{finale_bar * 10} `Finished`", inline=False)
-            await message.edit(embed=embed)
-        except discord.HTTPException:
-            pass
+        if duration:
+            embed.add_field(name="Progress", value=progress_field_value(form_data, 0, duration), inline=False)
 
-        await asyncio.sleep(6)
+        message = await ctx.send(embed=embed)
+        last_now_playing_message_by_guild[guild_id] = message
 
-        try:
-            embed.set_field_at(0, name="Progress", value="🌙 The glow fades gently... `Complete`", inline=False)
-            await message.edit(embed=embed)
-        except discord.HTTPException:
-            pass
-    else:
-        await message.edit(content=f"▶️ Now playing: **{song_title}**")
+        if duration:
+            start_progress(guild_id, message, embed, form_data, song_title, duration)
+        else:
+            await message.edit(content=f"▶️ Now playing: **{song_title}**")
+
+def live_upload_id(catalog):
+    """to_entry for upload segments: IDs deleted since the segment was queued are skipped."""
+    return lambda upload_id: upload_id if upload_id in catalog else None
+
+def queue_entry_title(song, guild_id):
+    if isinstance(song, LazySegment):
+        return str(song)
+    if isinstance(song, tuple):
+        return os.path.basename(song[1])
+    upload = upload_catalog_by_guild[guild_id].get(song)
+    if upload is None:
+        return f"#{song} (deleted)"
+    return f"{upload.filename} ({format_duration(upload.duration)})" if upload.duration else upload.filename
+
+players_by_guild = {}
+
+def get_player(guild_id):
+    player = players_by_guild.get(guild_id)
+    if player is None or player.task.done():
+        player = players_by_guild[guild_id] = GuildPlayer(guild_id)
+    return player
+
+async def play_next(ctx):
+    """Asks the guild's player to start the next song if nothing is playing."""
+    await get_player(ctx.guild.id).send("play", ctx)
 
 @bot.command(aliases=["mixitup", "mischen", "shuff"])
 async def shuffle(ctx):
     """Shuffles the current music queue with seasonal joy."""
     form_data = get_seasonal_form_data()
-    guild_id = ctx.guild.id
-    queue = song_queue_by_guild.get(guild_id, [])
 
-    if len(queue) > 1:
-        random.shuffle(queue)
+    if await get_player(ctx.guild.id).send("shuffle", ctx):
         await ctx.send(form_data.get("shuffle_message", "🔀 The playlist has been shuffled!"))
     else:
         await ctx.send(form_data.get("shuffle_too_short_message", "🌱 Not enough tunes to shuffle — add more!"))
@@ -1035,6 +2553,7 @@ async def pause(ctx):
 
     if ctx.voice_client and ctx.voice_client.is_playing():
         ctx.voice_client.pause()
+        pause_progress(ctx.guild.id)
         await ctx.send(form_data.get("pause_message", "💤 The music takes a gentle pause."))
 
 @bot.command(aliases=["youmayspeak"])
@@ -1044,6 +2563,7 @@ async def resume(ctx):
 
     if ctx.voice_client and ctx.voice_client.is_paused():
         ctx.voice_client.resume()
+        resume_progress(ctx.guild.id)
         await ctx.send(form_data.get("resume_message", "💓 The melody resumes — flowing once more!"))
 
 @bot.command(aliases=["nextplease", "next", "skippy"])
@@ -1051,9 +2571,7 @@ async def skip(ctx):
     """Skips the current song with seasonal flavor."""
     form_data = get_seasonal_form_data()
 
-    if ctx.voice_client and ctx.voice_client.is_playing():
-        ctx.voice_client.stop()
-        await play_next(ctx)
+    if await get_player(ctx.guild.id).send("skip", ctx):
         await ctx.send(form_data.get("skip_message", "⏭ Skipping to the next song!"))
 
 @bot.command(aliases=["turnitup", "tooloud", "v"])
@@ -1063,15 +2581,38 @@ async def volume(ctx, volume: int):
     form_data = get_seasonal_form_data()
 
     if 1 <= volume <= 100:
-        volume_levels_by_guild[guild_id] = volume / 100.0
-
-        if ctx.voice_client and ctx.voice_client.source:
-            ctx.voice_client.source.volume = volume_levels_by_guild[guild_id]
+        applied_now = await get_player(guild_id).send("volume", ctx, volume / 100.0)
 
         await ctx.send(form_data.get("volume_message", f"🔊 Volume set to **{volume}%**").format(volume=volume))
+        if not applied_now:
+            await ctx.send("🎼 This song is streaming as Opus — the new volume applies from the next song.")
     else:
         await ctx.send(form_data.get("volume_invalid_message", "🚫 Volume must be between 1 and 100."))
 
+@bot.command(aliases=["stream", "sm"])
+async def streammode(ctx, mode: str = None):
+    """Switches YouTube playback between direct streaming and download-then-play for this server."""
+    guild_id = ctx.guild.id
+
+    if mode is None:
+        current = "on" if is_stream_mode(guild_id) else "off"
+        await ctx.send(f"🌊 Streaming mode is **{current}**. Use `!streammode on`, `off` or `default`.")
+        return
+
+    mode = mode.lower()
+    if mode in ("on", "true", "yes"):
+        stream_mode_by_guild[guild_id] = True
+    elif mode in ("off", "false", "no"):
+        stream_mode_by_guild[guild_id] = False
+    elif mode == "default":
+        stream_mode_by_guild.pop(guild_id, None)
+    else:
+        await ctx.send("🚫 Use `!streammode on`, `off` or `default`.")
+        return
+
+    current = "on" if is_stream_mode(guild_id) else "off"
+    await ctx.send(f"🌊 Streaming mode is now **{current}** — it applies from the next song.")
+
 @bot.command(aliases=["whatsnext", "q"])
 async def queue(ctx):
     """Displays the current queue with pagination and a shuffle button."""
@@ -1092,11 +2633,10 @@ async def queue(ctx):
         async def send_page(self, interaction=None, message=None):
             queue = song_queue_by_guild[self.guild_id]
             start = self.page * self.items_per_page
-            end = start + self.items_per_page
-            page_items = queue[start:end]
+            page_items = queue.page(start, self.items_per_page)
 
             queue_display = '\n'.join([
-                f"{i+1}. {os.path.basename(song[1]) if isinstance(song, tuple) else os.path.basename(song)}"
+                f"{i+1}. {queue_entry_title(song, self.guild_id)}"
                 for i, song in enumerate(page_items, start=start)
             ])
 
@@ -1105,7 +2645,7 @@ async def queue(ctx):
                 description=queue_display or form_data.get("queue_page_empty_message", "🌤️ This page is feeling a little empty..."),
                 color=form_data.get("color", 0xFFE680)
             )
-            embed.set_footer(text="Use the buttons below to navigate or shuffle ✨")
+            embed.set_footer(text=f"{queue.song_count()} songs queued • Use the buttons below to navigate or shuffle ✨")
 
             if interaction:
                 await interaction.response.edit_message(embed=embed, view=self)
@@ -1128,24 +2668,109 @@ async def queue(ctx):
 
         @discord.ui.button(label="🔀 Shuffle", style=discord.ButtonStyle.green)
         async def shuffle_queue(self, interaction: discord.Interaction, button: Button):
-            queue = song_queue_by_guild[self.guild_id]
-            random.shuffle(queue)
-            self.page = 0
+            # Answered first: the player may be busy and Discord only waits 3 seconds
             await interaction.response.send_message(
                 form_data.get("queue_shuffle_success_message", "🔀 Queue reshuffled!"), ephemeral=True
             )
+            await get_player(self.guild_id).send("shuffle", ctx)
+            self.page = 0
             await self.send_page(interaction)
 
     view = QueuePages(guild_id)
     await view.send_page(message=await ctx.send(view=view))
 
+def parse_queue_position(value, queue_length):
+    """Turns a 1-based queue number into an index, or None if it's not a valid position."""
+    try:
+        position = int(value.strip(','))
+    except ValueError:
+        return None
+    return position - 1 if 1 <= position <= queue_length else None
+
+@bot.command(aliases=["mv", "reorder"])
+async def move(ctx, source: str, destination: str):
+    """Moves a queued song to another position. Usage: !move <from> <to>
+
+    A block queued by !playbypage, !playalluploads or !playbytag is one position and moves as a whole.
+    """
+    guild_id = ctx.guild.id
+    queue = song_queue_by_guild[guild_id]
+    source_index = parse_queue_position(source, len(queue))
+    destination_index = parse_queue_position(destination, len(queue))
+
+    if source_index is None or destination_index is None:
+        await ctx.send(f"🚫 Positions must be between 1 and {len(queue)}. Check `!queue` for numbers.")
+        return
+
+    song = queue.move(source_index, destination_index)
+    schedule_prefetch(guild_id)
+    await ctx.send(f"🔃 Moved **{queue_entry_title(song, guild_id)}** to position {destination_index + 1}.")
+
+@bot.command(aliases=["rm", "dequeue"])
+async def remove(ctx, *positions):
+    """Removes one or more songs from the queue by position. Usage: !remove <numbers...>
+
+    A block queued by !playbypage, !playalluploads or !playbytag is one position and is removed as a whole.
+    """
+    guild_id = ctx.guild.id
+    queue = song_queue_by_guild[guild_id]
+
+    if not positions:
+        await ctx.send("🌱 Tell me which queue positions to remove, e.g. `!remove 3 5`.")
+        return
+
+    indexes = set()
+    invalid = []
+    for value in positions:
+        index = parse_queue_position(value, len(queue))
+        if index is None:
+            invalid.append(value)
+        else:
+            indexes.add(index)
+
+    # Highest first so earlier removals don't shift the later ones
+    removed = [queue.pop(index) for index in sorted(indexes, reverse=True)]
+    if removed:
+        schedule_prefetch(guild_id)
+        names = ", ".join(queue_entry_title(song, guild_id) for song in reversed(removed))
+        await ctx.send(f"🗑️ Removed {len(removed)} song(s) from the queue: {names}")
+    if invalid:
+        await ctx.send(f"⚠️ Skipped invalid positions: {', '.join(invalid)}")
+
+@bot.command(aliases=["playat", "putat"])
+async def insert(ctx, position: int, url: str):
+    """Inserts a YouTube song at a queue position. Usage: !insert <position> <url>"""
+    guild_id = ctx.guild.id
+    queue = song_queue_by_guild[guild_id]
+    index = min(max(position, 1), len(queue) + 1) - 1
+
+    try:
+        info = await lookup_track(url, PRIORITY_PLAYBACK if not queue else PRIORITY_METADATA, guild_id)
+    except Exception as e:
+        await ctx.send(f"⚠️ A cloud blocked the song: `{e}`")
+        return
+    if 'entries' in info:
+        await ctx.send("🚫 `!insert` takes a single song — use `!play` for playlists.")
+        return
+
+    if not enqueue(guild_id, [(info['webpage_url'], info['title'])], index):
+        await ctx.send(QUEUE_FULL_MESSAGE)
+        return
+    schedule_prefetch(guild_id)
+    await ctx.send(f"📌 Inserted **{info['title']}** at position {index + 1}.")
+
 @bot.command(aliases=["whatwegot"])
-async def listsongs(ctx):
-    """Lists available uploaded songs with optional tag filter, pagination, and actions."""
+async def listsongs(ctx, *query):
+    """Lists available uploaded songs with optional tag filter, pagination, and actions.
+
+    A tag query narrows the list up front: `!listsongs chill +night -sad`.
+    """
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
+    tag_index = tag_index_by_guild[guild_id]
+    catalog = upload_catalog_by_guild[guild_id]
 
-    if not uploaded_files_by_guild[guild_id]:
+    if not catalog:
         await ctx.send(form_data.get("uploads_empty_message", "🌥️ No uploads yet — upload a song to begin."))
         return
 
@@ -1156,22 +2781,26 @@ async def listsongs(ctx):
         def __init__(self):
             self.current_page = 0
             self.page_range_index = 0
-            self.filtered_files = uploaded_files_by_guild[guild_id][:]
+            self.filtered_files = catalog.ids[:]  # Upload IDs
             self.selected_tag = None
 
     state = State()
+    if query:
+        any_of, all_of, none_of = parse_tag_query(query)
+        state.selected_tag = describe_tag_query(any_of, all_of, none_of)
+        state.filtered_files = tag_index.query(any_of, all_of, none_of, universe=catalog.ids)
 
     def get_page_embed():
-        uploaded_files = uploaded_files_by_guild[guild_id]
-        file_tags = file_tags_by_guild[guild_id]
-
         start = state.current_page * per_page
         end = start + per_page
         page = state.filtered_files[start:end]
 
         song_list = ""
-        for i, song in enumerate(page):
-            song_list += f"{start + i + 1}. {song}\n"
+        for upload_id in page:
+            upload = catalog.get(upload_id)
+            if upload:  # Deleted since the list was filtered
+                length = f" `{format_duration(upload.duration)}`" if upload.duration else ""
+                song_list += f"{upload.id}. {upload.filename}{length}\n"
 
         total_pages = max(1, math.ceil(len(state.filtered_files) / per_page))
         title = form_data.get("uploads_embed_title", "📂 Uploaded Songs")
@@ -1188,16 +2817,14 @@ async def listsongs(ctx):
 
     class TagSelector(Select):
         def __init__(self):
-            file_tags = file_tags_by_guild[guild_id]
-            all_tags = sorted(set(tag for tags in file_tags.values() for tag in tags))
+            # Discord allows 25 options, so the most used tags get the slots
+            top_tags = sorted(tag_index.counts().items(), key=lambda item: (-item[1], item[0]))[:24]
             options = [discord.SelectOption(label="🌈 All Songs", value="all")] + [
-                discord.SelectOption(label=tag, value=tag) for tag in all_tags
+                discord.SelectOption(label=f"{tag} ({count})", value=tag) for tag, count in top_tags
             ]
             super().__init__(placeholder="🎨 Filter by tag...", options=options)
 
         async def callback(self, interaction: discord.Interaction):
-            file_tags = file_tags_by_guild[guild_id]
-            uploaded_files = uploaded_files_by_guild[guild_id]
 
             choice = self.values[0]
             state.selected_tag = None if choice == "all" else choice
@@ -1205,9 +2832,9 @@ async def listsongs(ctx):
             state.page_range_index = 0
 
             if state.selected_tag:
-                state.filtered_files = [f for f in uploaded_files if state.selected_tag in file_tags.get(f, [])]
+                state.filtered_files = sorted(tag_index.uploads_with(state.selected_tag))
             else:
-                state.filtered_files = uploaded_files[:]
+                state.filtered_files = catalog.ids[:]
 
             await interaction.response.edit_message(embed=get_page_embed(), view=view)
 
@@ -1226,15 +2853,11 @@ async def listsongs(ctx):
         async def play_page(self, interaction: discord.Interaction, button: Button):
             start = state.current_page * per_page
             end = start + per_page
-            added = []
-            for filename in state.filtered_files[start:end]:
-                song_path = os.path.join(MUSIC_FOLDER, filename)
-                song_queue_by_guild[guild_id].append(song_path)
-                added.append(filename)
+            added = enqueue(guild_id, [upload_id for upload_id in state.filtered_files[start:end] if upload_id in catalog])
 
             message_template = form_data.get("uploads_page_play_message", "🎵 Queued {count} songs from this page.")
             await interaction.response.send_message(
-                message_template.format(count=len(added)),
+                message_template.format(count=added) if added else QUEUE_FULL_MESSAGE,
                 ephemeral=True
             )
 
@@ -1249,15 +2872,11 @@ async def listsongs(ctx):
             end = start + per_page
             page = state.filtered_files[start:end]
             random.shuffle(page)
-            added = []
-            for filename in page:
-                song_path = os.path.join(MUSIC_FOLDER, filename)
-                song_queue_by_guild[guild_id].append(song_path)
-                added.append(filename)
+            added = enqueue(guild_id, [upload_id for upload_id in page if upload_id in catalog])
 
             message_template = form_data.get("uploads_page_shuffle_message", "🔀 Shuffled {count} songs from this page.")
             await interaction.response.send_message(
-                message_template.format(count=len(added)),
+                message_template.format(count=added) if added else QUEUE_FULL_MESSAGE,
                 ephemeral=True
             )
 
@@ -1295,25 +2914,23 @@ async def playalluploads(ctx):
     """Adds all uploaded songs to the queue in shuffled order."""
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    uploaded_files = uploaded_files_by_guild.get(guild_id, [])
-    song_queue = song_queue_by_guild.setdefault(guild_id, [])
+    catalog = upload_catalog_by_guild[guild_id]
 
-    if not uploaded_files:
+    if not catalog:
         await ctx.send(form_data.get("uploads_empty_message", "🌥️ No songs uploaded yet."))
         return
 
-    shuffled_songs = uploaded_files[:]
-    random.shuffle(shuffled_songs)
-
-    for filename in shuffled_songs:
-        song_path = os.path.join(MUSIC_FOLDER, filename)
-        song_queue.append(song_path)
+    # One lazily shuffled segment over the current upload IDs instead of an entry per song
+    segment = LazySegment(list(catalog.ids), "🌈 All uploads (shuffled)", live_upload_id(catalog), shuffle=True)
+    if not enqueue(guild_id, [segment]):
+        await ctx.send(QUEUE_FULL_MESSAGE)
+        return
 
     message_template = form_data.get(
         "uploads_full_shuffle_message",
         "🌈 {count} uploaded songs have been shuffled into your queue."
     )
-    await ctx.send(message_template.format(count=len(shuffled_songs)))
+    await ctx.send(message_template.format(count=len(catalog)))
 
     # 🔌 Safer connection logic
     connected = await connect_to_voice(ctx)
@@ -1328,15 +2945,15 @@ async def playbypage(ctx, *pages):
     """Plays one or more pages of uploaded songs."""
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    uploaded_files = uploaded_files_by_guild.get(guild_id, [])
+    catalog = upload_catalog_by_guild[guild_id]
 
-    if not uploaded_files:
+    if not catalog:
         await ctx.send(form_data.get("uploads_empty_message", "🌥️ No uploads found yet."))
         return
 
     per_page = 10
-    total_pages = (len(uploaded_files) + per_page - 1) // per_page
-    added = []
+    total_pages = (len(catalog) + per_page - 1) // per_page
+    added = 0
 
     if not pages:
         await ctx.send("🌻 Please provide one or more page numbers to load songs. (e.g. `!page 1 2 3`)")
@@ -1350,11 +2967,12 @@ async def playbypage(ctx, *pages):
                 continue
 
             start = (page - 1) * per_page
-            end = start + per_page
-            for filename in uploaded_files[start:end]:
-                song_path = os.path.join(MUSIC_FOLDER, filename)
-                song_queue_by_guild.setdefault(guild_id, []).append(song_path)
-                added.append(filename)
+            page_ids = catalog.ids[start:start + per_page]  # Pinned, so later deletes can't shift the page
+            segment = LazySegment(page_ids, f"📄 Uploads page {page}", live_upload_id(catalog))
+            if not enqueue(guild_id, [segment]):
+                await ctx.send(QUEUE_FULL_MESSAGE)
+                break
+            added += segment.size
         except ValueError:
             await ctx.send(f"🌥️ `{page_str}` isn’t a valid number. Let’s float past it.")
 
@@ -1363,7 +2981,7 @@ async def playbypage(ctx, *pages):
         return
 
     message_template = form_data.get("uploads_page_play_message", "🎶 Added {count} songs from selected pages.")
-    await ctx.send(message_template.format(count=len(added)))
+    await ctx.send(message_template.format(count=added))
 
     connected = await connect_to_voice(ctx)
     if not connected:
@@ -1374,11 +2992,10 @@ async def playbypage(ctx, *pages):
 
 @bot.command(aliases=["number", "playnumber", "n"])
 async def playbynumber(ctx, *numbers):
-    """Plays one or multiple uploaded songs using their numbers (per-server)."""
+    """Plays one or multiple uploaded songs using their numbers from !listsongs (per-server)."""
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    uploaded_files = uploaded_files_by_guild.setdefault(guild_id, [])
-    song_queue = song_queue_by_guild.setdefault(guild_id, [])
+    catalog = upload_catalog_by_guild[guild_id]
 
     added_songs = []
 
@@ -1389,10 +3006,11 @@ async def playbynumber(ctx, *numbers):
     for num in numbers:
         try:
             num = int(num.strip(','))
-            if 1 <= num <= len(uploaded_files):
-                song_path = os.path.join(MUSIC_FOLDER, uploaded_files[num - 1])
-                song_queue.append(song_path)
-                added_songs.append(uploaded_files[num - 1])
+            if num in catalog:
+                if not enqueue(guild_id, [num]):
+                    await ctx.send(QUEUE_FULL_MESSAGE)
+                    break
+                added_songs.append(num)
             else:
                 await ctx.send(f"⚠️ Song number `{num}` is out of range. Use `!listsongs` to see available tracks.")
         except ValueError:
@@ -1417,8 +3035,8 @@ async def tag(ctx, *args):
     """Tags one or more uploaded songs. Usage: !tag <number(s)> <tags...> (per-server)"""
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    uploaded_files = uploaded_files_by_guild.setdefault(guild_id, [])
-    file_tags = file_tags_by_guild.setdefault(guild_id, {})
+    catalog = upload_catalog_by_guild[guild_id]
+    tag_index = tag_index_by_guild[guild_id]
 
     if len(args) < 2:
         usage_message = form_data.get(
@@ -1449,13 +3067,10 @@ async def tag(ctx, *args):
 
     tagged = []
     for num in numbers:
-        if 1 <= num <= len(uploaded_files):
-            filename = uploaded_files[num - 1]
-            file_tags.setdefault(filename, [])
-            for tag in tags:
-                if tag not in file_tags[filename]:
-                    file_tags[filename].append(tag)
-            tagged.append(filename)
+        upload = catalog.get(num)
+        if upload:
+            tag_index.add(upload.id, tags)
+            tagged.append(upload)
         else:
             invalid_num_message = form_data.get(
                 "tag_invalid_number_message",
@@ -1469,10 +3084,10 @@ async def tag(ctx, *args):
             "🏷️ Tagged: {files} with `{tags}`"
         )
         await ctx.send(success_message.format(
-            files=", ".join(tagged),
+            files=", ".join(upload.filename for upload in tagged),
             tags=", ".join(tags)
         ))
-        save_upload_data()
+        persist(upload_store.add_tags, [upload.id for upload in tagged], tags)
     else:
         no_tagged_message = form_data.get(
             "tag_no_tagged_message",
@@ -1482,13 +3097,15 @@ async def tag(ctx, *args):
 
 @bot.command(aliases=["tagplay", "greenflag", "pt"])
 async def playbytag(ctx, *search_tags):
-    """Plays all uploaded songs that match one or more tags. Usage: !playbytag chill vibe (per-server)"""
+    """Plays uploaded songs matching a tag query. Usage: !playbytag chill vibe +night -sad (per-server)
+
+    Bare tags match any of them, `+tag` is required and `-tag` is excluded.
+    """
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    uploaded_files = uploaded_files_by_guild.setdefault(guild_id, [])
-    file_tags = file_tags_by_guild.setdefault(guild_id, {})
+    catalog = upload_catalog_by_guild[guild_id]
 
-    if not uploaded_files:
+    if not catalog:
         empty_message = form_data.get(
             "uploads_empty_message",
             "🌥️ No uploads yet — add some sunshine first with an upload."
@@ -1504,29 +3121,28 @@ async def playbytag(ctx, *search_tags):
         await ctx.send(no_args_message)
         return
 
-    tags_lower = [t.lower() for t in search_tags]
-    matched = [
-        f for f in uploaded_files
-        if any(tag in file_tags.get(f, []) for tag in tags_lower)
-    ]
+    any_of, all_of, none_of = parse_tag_query(search_tags)
+    query_text = describe_tag_query(any_of, all_of, none_of)
+    matched = tag_index_by_guild[guild_id].query(any_of, all_of, none_of, universe=catalog.ids)
 
     if not matched:
         no_matches_message = form_data.get(
             "playbytag_no_matches_message",
             "☁️ No songs found glowing with tag(s): `{tags}`."
         )
-        await ctx.send(no_matches_message.format(tags=", ".join(tags_lower)))
+        await ctx.send(no_matches_message.format(tags=query_text))
         return
 
-    for filename in matched:
-        song_path = os.path.join(MUSIC_FOLDER, filename)
-        song_queue_by_guild.setdefault(guild_id, []).append(song_path)
+    segment = LazySegment(matched, f"🏷️ Tagged {query_text}", live_upload_id(upload_catalog_by_guild[guild_id]))
+    if not enqueue(guild_id, [segment]):
+        await ctx.send(QUEUE_FULL_MESSAGE)
+        return
 
     success_message = form_data.get(
         "playbytag_success_message",
         "🌈 Added {count} tracks matching `{tags}` to the queue."
     )
-    await ctx.send(success_message.format(count=len(matched), tags=", ".join(tags_lower)))
+    await ctx.send(success_message.format(count=len(matched), tags=query_text))
 
     connected = await connect_to_voice(ctx)
     if not connected:
@@ -1540,14 +3156,9 @@ async def listtags(ctx):
     """Shows all tags currently in use for uploaded songs (per-server)."""
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    file_tags = file_tags_by_guild.setdefault(guild_id, {})
-
-    # Gather all unique tags
-    unique_tags = set()
-    for tags in file_tags.values():
-        unique_tags.update(tags)
+    tag_counts = tag_index_by_guild[guild_id].counts()
 
-    if not unique_tags:
+    if not tag_counts:
         empty_message = form_data.get(
             "listtags_empty_message",
             "🌫️ No tags exist yet — nothing is dancing in the air."
@@ -1555,8 +3166,7 @@ async def listtags(ctx):
         await ctx.send(empty_message)
         return
 
-    sorted_tags = sorted(unique_tags)
-    tag_text = ", ".join(sorted_tags)
+    tag_text = ", ".join(f"{tag} ({count})" for tag, count in sorted(tag_counts.items()))
 
     max_length = 4000  # Leave room for formatting and footer
     if len(tag_text) > max_length:
@@ -1586,8 +3196,8 @@ async def removetag(ctx, *args):
     """Removes all tags from specified songs, or removes a specific tag from all songs."""
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    file_tags = file_tags_by_guild.setdefault(guild_id, {})
-    uploaded_files = uploaded_files_by_guild.setdefault(guild_id, [])
+    tag_index = tag_index_by_guild[guild_id]
+    catalog = upload_catalog_by_guild[guild_id]
 
     if not args:
         embed = discord.Embed(
@@ -1604,8 +3214,6 @@ async def removetag(ctx, *args):
     loading_message = await ctx.send(loading_message_text)
     await asyncio.sleep(1)
 
-    did_change = False
-
     if args[0].isdigit():
         numbers = []
         invalid = []
@@ -1617,18 +3225,16 @@ async def removetag(ctx, *args):
 
         cleared = []
         for num in numbers:
-            if 1 <= num <= len(uploaded_files):
-                filename = uploaded_files[num - 1]
-                if filename in file_tags and file_tags[filename]:
-                    file_tags[filename] = []
-                    cleared.append(filename)
-                    did_change = True
+            upload = catalog.get(num)
+            if upload and tag_index.clear_upload(upload.id):
+                cleared.append(upload)
 
         if cleared:
+            persist(upload_store.clear_tags, [upload.id for upload in cleared])
             cleared_message = form_data.get("removetag_success_message", "Tags cleared from: {files}.")
             embed = discord.Embed(
                 title="✅ Tags Cleared",
-                description=cleared_message.format(files=", ".join(cleared)),
+                description=cleared_message.format(files=", ".join(upload.filename for upload in cleared)),
                 color=discord.Color.from_str("#fff0b3")
             )
             embed.set_footer(text="✨ Fresh, tag-free melodies await.")
@@ -1652,15 +3258,10 @@ async def removetag(ctx, *args):
 
     else:
         tag_to_remove = args[0].lower()
-        removed_from = []
-
-        for filename, tags in file_tags.items():
-            if tag_to_remove in tags:
-                tags.remove(tag_to_remove)
-                removed_from.append(filename)
-                did_change = True
+        removed_from = [upload.filename for upload in map(catalog.get, tag_index.remove_tag(tag_to_remove)) if upload]
 
         if removed_from:
+            persist(upload_store.remove_tag, guild_id, tag_to_remove)
             tag_removed_message = form_data.get("removetag_tag_removed_message", "Removed `{tag}` from: {files}.")
             embed = discord.Embed(
                 title="🏷️ Tag Removed",
@@ -1678,18 +3279,12 @@ async def removetag(ctx, *args):
 
         await loading_message.edit(content=None, embed=embed)
 
-    if did_change:
-        save_upload_data()
-
 @bot.command(aliases=["shutup", "nomore", "stoppen"])
 async def stop(ctx):
     """Stops playback and clears the queue."""
-    guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    song_queue_by_guild[guild_id] = []
 
-    if ctx.voice_client and ctx.voice_client.is_playing():
-        ctx.voice_client.stop()
+    if await get_player(ctx.guild.id).send("stop", ctx):
         await ctx.send(form_data.get("stop_active_message", "🌤️ Playback has stopped — the melody rests."))
     else:
         await ctx.send(form_data.get("stop_idle_message", "🕊️ Already silent, but your queue has been cleared."))
@@ -1699,8 +3294,8 @@ async def deleteupload(ctx, *numbers):
     """Deletes one or multiple uploaded songs by their numbers (from !listsongs)."""
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    uploaded_files = uploaded_files_by_guild.get(guild_id, [])
-    file_tags = file_tags_by_guild.get(guild_id, {})
+    catalog = upload_catalog_by_guild[guild_id]
+    tag_index = tag_index_by_guild[guild_id]
 
     if not numbers:
         await ctx.send(form_data.get("deleteupload_no_args_message", "🌱 Please share which songs to release."))
@@ -1711,38 +3306,22 @@ async def deleteupload(ctx, *numbers):
 
     for num_str in numbers:
         try:
-            num = int(num_str.strip(','))
-            if 1 <= num <= len(uploaded_files):
-                filename = uploaded_files[num - 1]
-                file_path = os.path.join(MUSIC_FOLDER, filename)
-
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                    except Exception as e:
-                        print(f"[Warning] Could not delete {filename}: {e}")
-
-                deleted.append(filename)
+            upload = catalog.remove(int(num_str.strip(',')))
+            if upload:
+                release_upload_file(upload)
+                tag_index.clear_upload(upload.id)
+                deleted.append(upload)
             else:
                 invalid.append(num_str)
         except ValueError:
             invalid.append(num_str)
 
-    for filename in deleted:
-        if filename in uploaded_files:
-            uploaded_files.remove(filename)
-        if filename in file_tags:
-            del file_tags[filename]
-
-    uploaded_files_by_guild[guild_id] = uploaded_files
-    file_tags_by_guild[guild_id] = file_tags
-    save_upload_data()
-
     if deleted:
+        persist(upload_store.remove_uploads, [upload.id for upload in deleted])
         await ctx.send(
             form_data.get("deleteupload_success_message", "💫 Deleted files: {files}").format(
                 count=len(deleted),
-                files=", ".join(deleted)
+                files=", ".join(upload.filename for upload in deleted)
             )
         )
     if invalid:
@@ -1752,12 +3331,31 @@ async def deleteupload(ctx, *numbers):
             )
         )
 
+@bot.command(aliases=["rename", "ru"])
+async def renameupload(ctx, number: int, *, new_name: str):
+    """Renames an uploaded song. Its number, tags and queued copies are unaffected."""
+    catalog = upload_catalog_by_guild[ctx.guild.id]
+    upload = catalog.get(number)
+    if upload is None:
+        await ctx.send(f"⚠️ Song number `{number}` doesn’t exist. Use `!listsongs` to see available tracks.")
+        return
+
+    old_name = upload.filename
+    if not catalog.rename(number, new_name):
+        await ctx.send(f"🚫 Another upload is already called `{new_name}`.")
+        return
+
+    persist(upload_store.update_upload, number, {"filename": new_name})
+    await ctx.send(f"✏️ Renamed `{old_name}` to `{new_name}`.")
+
 @bot.command(aliases=["spankies", "cq"])
 async def clearqueue(ctx):
     """Clears the music queue for this server only."""
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    song_queue_by_guild[guild_id] = []
+    song_queue_by_guild[guild_id].clear()
+    cancel_playlist_loaders(guild_id)
+    cancel_prefetch(guild_id)
 
     await ctx.send(form_data.get("clearqueue_message", "🌈 The queue has been cleared — fresh vibes await."))
 
@@ -1766,9 +3364,9 @@ async def clearuploads(ctx):
     """Deletes all uploaded files for this server to free space, with confirmation."""
     guild_id = ctx.guild.id
     form_data = get_seasonal_form_data()
-    uploaded_files = uploaded_files_by_guild.get(guild_id, [])
+    catalog = upload_catalog_by_guild[guild_id]
 
-    if not uploaded_files:
+    if not catalog:
         await ctx.send(form_data.get("clearuploads_nothing_message", "🌥️ Nothing to clear — skies are already clear."))
         return
 
@@ -1785,20 +3383,13 @@ async def clearuploads(ctx):
                 )
                 return
 
-            file_count = 0
-            for filename in uploaded_files_by_guild[guild_id]:
-                file_path = os.path.join(MUSIC_FOLDER, filename)
-                if os.path.exists(file_path) and filename.endswith(('.mp3', '.wav')):
-                    try:
-                        os.remove(file_path)
-                        file_count += 1
-                    except Exception as e:
-                        print(f"[Warning] Failed to delete {filename}: {e}")
+            file_count = len(catalog)
+            for upload in catalog:
+                release_upload_file(upload)  # Files other servers still use are kept
 
-            uploaded_files_by_guild[guild_id] = []
-            file_tags_by_guild[guild_id] = {}
-
-            save_upload_data()
+            catalog.clear()
+            tag_index_by_guild[guild_id].clear()
+            persist(upload_store.clear_guild, guild_id)
 
             await interaction.response.edit_message(
                 content=form_data.get(
@@ -1828,115 +3419,139 @@ async def clearuploads(ctx):
 
 # ------ Playlist Commands (attach these to your existing bot) ------
 
+UPLOAD_ENTRY_PREFIX = "upload:"  # Playlist rows that point at an upload ID rather than a URL
+
+def playlist_entry_row(song):
+    """Splits a queue entry into the (value, title) pair stored per playlist row."""
+    if isinstance(song, tuple):
+        return song[0], song[1]
+    return f"{UPLOAD_ENTRY_PREFIX}{song}", None
+
+def playlist_upload_entry(guild_id, value):
+    """Maps an upload row (or a legacy file path) back to an upload ID, or None if it's gone."""
+    catalog = upload_catalog_by_guild[guild_id]
+    if value.startswith(UPLOAD_ENTRY_PREFIX):
+        upload_id = int(value[len(UPLOAD_ENTRY_PREFIX):])
+        return upload_id if upload_id in catalog else None
+    upload = catalog.find(os.path.basename(value))
+    return upload.id if upload else None
+
 @bot.command(aliases=["mkplaylist", "newlist"])
 async def createplaylist(ctx, playlist_name: str):
-    guild_id = str(ctx.guild.id)
-    ensure_guild_playlists(guild_id)
-    
-    if playlist_name in playlists_by_guild[guild_id]:
+    if not await asyncio.to_thread(playlist_store.create, ctx.guild.id, playlist_name):
         await ctx.send(f"🚫 Playlist `{playlist_name}` already exists!")
         return
 
-    playlists_by_guild[guild_id][playlist_name] = []
-    save_playlists()
     await ctx.send(f"🎶 Created new playlist: `{playlist_name}`!")
 
 @bot.command(aliases=["rmlist", "deletepl"])
 async def deleteplaylist(ctx, playlist_name: str):
-    guild_id = str(ctx.guild.id)
-    ensure_guild_playlists(guild_id)
-
-    if playlist_name not in playlists_by_guild[guild_id]:
+    if not await asyncio.to_thread(playlist_store.delete, ctx.guild.id, playlist_name):
         await ctx.send(f"🚫 Playlist `{playlist_name}` doesn’t exist!")
         return
 
-    del playlists_by_guild[guild_id][playlist_name]
-    save_playlists()
     await ctx.send(f"🗑️ Deleted playlist `{playlist_name}`.")
 
 @bot.command(aliases=["addsong", "pladd"])
 async def addtoplaylist(ctx, playlist_name: str, *, url: str):
-    guild_id = str(ctx.guild.id)
-    ensure_guild_playlists(guild_id)
-
-    if playlist_name not in playlists_by_guild[guild_id]:
+    if await asyncio.to_thread(playlist_store.append, ctx.guild.id, playlist_name, [(url, None)]) is None:
         await ctx.send(f"🚫 Playlist `{playlist_name}` not found!")
         return
 
-    playlists_by_guild[guild_id][playlist_name].append(url)
-    save_playlists()
     await ctx.send(f"✅ Added to `{playlist_name}`!")
 
+@bot.command(aliases=["plinsert", "plputat"])
+async def insertintoplaylist(ctx, playlist_name: str, position: int, *, url: str):
+    if not await asyncio.to_thread(playlist_store.insert, ctx.guild.id, playlist_name, max(position - 1, 0), url):
+        await ctx.send(f"🚫 Playlist `{playlist_name}` not found!")
+        return
+
+    await ctx.send(f"✅ Added to `{playlist_name}` at position {max(position, 1)}!")
+
 @bot.command(aliases=["addq", "pladdqueue"])
 async def addqueue(ctx, playlist_name: str):
-    guild_id = str(ctx.guild.id)
-    ensure_guild_playlists(guild_id)
-
-    if playlist_name not in playlists_by_guild[guild_id]:
+    if not await asyncio.to_thread(playlist_store.exists, ctx.guild.id, playlist_name):
         await ctx.send(f"🚫 Playlist `{playlist_name}` not found!")
         return
 
-    queue = song_queue_by_guild.get(ctx.guild.id, [])
+    queue = song_queue_by_guild[ctx.guild.id]
     if not queue:
         await ctx.send("🌥️ Nothing in queue to add!")
         return
 
-    for song_path in queue:
-        playlists_by_guild[guild_id][playlist_name].append(song_path)
-    save_playlists()
-    await ctx.send(f"✅ Added {len(queue)} songs to `{playlist_name}`!")
+    rows = []
+    for entry in queue:
+        songs = entry if isinstance(entry, LazySegment) else (entry,)
+        rows.extend(playlist_entry_row(song) for song in songs)
+    added = await asyncio.to_thread(playlist_store.append, ctx.guild.id, playlist_name, rows)
+    await ctx.send(f"✅ Added {added} songs to `{playlist_name}`!")
 
 @bot.command(aliases=["remsong", "plremove"])
 async def removefromplaylist(ctx, playlist_name: str, index: int):
-    guild_id = str(ctx.guild.id)
-    ensure_guild_playlists(guild_id)
-
-    if playlist_name not in playlists_by_guild[guild_id]:
+    if not await asyncio.to_thread(playlist_store.exists, ctx.guild.id, playlist_name):
         await ctx.send(f"🚫 Playlist `{playlist_name}` not found!")
         return
 
-    try:
-        removed = playlists_by_guild[guild_id][playlist_name].pop(index - 1)
-        save_playlists()
-        await ctx.send(f"🗑️ Removed: `{removed}` from `{playlist_name}`.")
-    except IndexError:
-        await ctx.send(f"🚫 Invalid index — playlist only has {len(playlists_by_guild[guild_id][playlist_name])} items.")
+    removed = await asyncio.to_thread(playlist_store.remove_at, ctx.guild.id, playlist_name, index - 1)
+    if removed is None:
+        count = await asyncio.to_thread(playlist_store.count, ctx.guild.id, playlist_name)
+        await ctx.send(f"🚫 Invalid index — playlist only has {count} items.")
+        return
+
+    await ctx.send(f"🗑️ Removed: `{removed}` from `{playlist_name}`.")
 
 @bot.command(aliases=["myplaylists", "listsaved"])
 async def listplaylists(ctx):
-    guild_id = str(ctx.guild.id)
-    ensure_guild_playlists(guild_id)
-
-    playlists = playlists_by_guild[guild_id]
+    playlists = await asyncio.to_thread(playlist_store.summaries, ctx.guild.id)
     if not playlists:
         await ctx.send("📂 No playlists yet!")
         return
 
     embed = discord.Embed(title="🎶 Your Playlists:", color=discord.Color.blurple())
-    for name, items in playlists.items():
-        embed.add_field(name=name, value=f"{len(items)} song(s)", inline=False)
+    for name, count in playlists[:25]:  # Discord caps embeds at 25 fields
+        embed.add_field(name=name, value=f"{count} song(s)", inline=False)
 
     await ctx.send(embed=embed)
 
 @bot.command(aliases=["plplay"])
 async def playplaylist(ctx, playlist_name: str):
-    guild_id = str(ctx.guild.id)
-    ensure_guild_playlists(guild_id)
-    form_data = get_seasonal_form_data()
-
-    if playlist_name not in playlists_by_guild[guild_id]:
+    if not await asyncio.to_thread(playlist_store.exists, ctx.guild.id, playlist_name):
         await ctx.send(f"🚫 Playlist `{playlist_name}` not found!")
         return
 
-    playlist = playlists_by_guild[guild_id][playlist_name]
-    if not playlist:
-        await ctx.send("🌥️ Playlist is empty!")
+    queued = 0
+    full = False
+    # Entries are read a page at a time off the event loop, so a huge playlist never sits in memory twice
+    entries = playlist_store.iter_entries(ctx.guild.id, playlist_name)
+
+    def next_page():
+        return list(itertools.islice(entries, PlaylistStore.PAGE_SIZE))
+
+    while not full and (page := await asyncio.to_thread(next_page)):
+        for value, title in page:
+            if title is not None:  # (url, title) entries saved by !addqueue
+                item = (value, title)
+            elif value.startswith(("http://", "https://")):
+                # A placeholder like the ones !play queues: prefetch or the player resolves it later
+                cached = get_cached_metadata(value)
+                item = (value, cached['title'] if cached else value)
+            else:
+                item = playlist_upload_entry(ctx.guild.id, value)
+                if item is None:
+                    await ctx.send(f"⚠️ Skipped `{value}`: that upload no longer exists.")
+                    continue
+            if not enqueue(ctx.guild.id, [item]):
+                await ctx.send(QUEUE_FULL_MESSAGE)
+                full = True
+                break
+            queued += 1
+
+    if not queued:
+        if not full:
+            await ctx.send("🌥️ Playlist is empty!")
         return
 
-    for item in playlist:
-        song_queue_by_guild[guild_id].append(item)
-
-    await ctx.send(f"🎧 Queued `{len(playlist)}` songs from `{playlist_name}`!")
+    await ctx.send(f"🎧 Queued `{queued}` songs from `{playlist_name}`!")
 
     connected = await connect_to_voice(ctx)
     if not connected:
@@ -1945,16 +3560,180 @@ async def playplaylist(ctx, playlist_name: str):
     if not ctx.voice_client.is_playing():
         await play_next(ctx)
 
+def export_playlists(guild_id):
+    """Streams one guild's playlists into a temporary JSON file for !backupechosol."""
+    path = f"playlists_{guild_id}.json"
+    with open(path, "w") as f:
+        playlist_store.export_guild(guild_id, f)
+    return path
+
 @bot.command(aliases=["backupecho"])
 async def backupechosol(ctx):
+    path = None
     try:
-        with open(PLAYLISTS_FILE, "rb") as f:
+        path = await asyncio.to_thread(export_playlists, ctx.guild.id)
+        with open(path, "rb") as f:
             await ctx.send("📂 Playlist backup:", file=discord.File(f, PLAYLISTS_FILE))
     except Exception as e:
         await ctx.send(f"🚫 Backup failed: {e}")
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+@bot.command(aliases=["echostats", "health"])
+async def stats(ctx):
+    """Shows worker pool load and other internals for tuning."""
+    embed = discord.Embed(title="📊 Echosol Internals", color=discord.Color.blurple())
+    for pool in (extractor_pool, ingest_pool):
+        embed.add_field(
+            name=f"🧵 {pool.name.title()} pool",
+            value=(
+                f"Queue depth: **{pool.queue_depth}** ({pool.running} running, {pool.waiting} waiting)\n"
+                f"Workers: {len(pool.idle_workers)} idle / {pool.size} max\n"
+                f"Jobs: {pool.completed} ok, {pool.failed} failed, {pool.timed_out} timed out"
+            ),
+            inline=False
+        )
+
+    def class_line(name, stats, waiting):
+        average = stats["wait_total"] / stats["jobs"] if stats["jobs"] else 0.0
+        return (
+            f"{name.title()}: {stats['jobs']} jobs, wait avg **{average:.2f}s** / max {stats['wait_max']:.1f}s, "
+            f"{waiting} waiting, {stats['starved']} starved"
+        )
+
+    bandwidth = f"{DOWNLOAD_BANDWIDTH_LIMIT // 1024} KB/s" if DOWNLOAD_BANDWIDTH_LIMIT else "unlimited"
+    embed.add_field(
+        name="🚦 Download scheduler",
+        value="\n".join(
+            [class_line(name, extractor_pool.class_stats[priority], extractor_pool.waiting_in(priority))
+             for priority, name in enumerate(PRIORITY_NAMES)]
+            + [f"Bandwidth: {bandwidth}, starvation after {STARVATION_SECONDS:g}s"]
+        ),
+        inline=False
+    )
+
+    def latency_line(samples):
+        if not samples:
+            return "no samples yet"
+        average = sum(seconds for seconds, _ in samples) / len(samples)
+        long_tracks = [seconds for seconds, duration in samples if duration >= LONG_TRACK_SECONDS]
+        line = f"avg **{average:.2f}s** over {len(samples)} tracks"
+        if long_tracks:
+            line += f", long tracks avg **{sum(long_tracks) / len(long_tracks):.2f}s** ({len(long_tracks)})"
+        return line
+
+    prefetch_count = sum(len(tasks_by_entry) for tasks_by_entry in prefetch_by_guild.values())
+    embed.add_field(
+        name="🔭 Prefetch",
+        value=f"{prefetch_count} tracks ahead, {prefetched_bytes() / (1024 * 1024):.1f} MB on disk (depth {PREFETCH_DEPTH})",
+        inline=False
+    )
+    embed.add_field(
+        name="🎼 Audio sources",
+        value=(
+            f"Opus passthrough: **{'on' if OPUS_PASSTHROUGH else 'off'}**\n"
+            f"Codec copy: {audio_source_stats['opus_copy']}, FFmpeg Opus encode: {audio_source_stats['opus_encode']}, "
+            f"PCM + re-encode: {audio_source_stats['pcm']}"
+        ),
+        inline=False
+    )
+    embed.add_field(
+        name="⏳ Progress scheduler",
+        value=(
+            f"{len(progress_by_guild)} active bars, updating every {progress_state['interval']:.0f}s "
+            f"(loop lag {progress_state['lag'] * 1000:.0f} ms)\n"
+            f"Edits: {progress_state['edits']} sent, {progress_state['deferred']} deferred for rate limits"
+        ),
+        inline=False
+    )
+    cached_bytes = sum(entry["size"] for entry in audio_cache_index.values())
+    lookups = audio_cache_stats["hits"] + audio_cache_stats["misses"]
+    hit_rate = f"{audio_cache_stats['hits'] / lookups:.0%}" if lookups else "n/a"
+    embed.add_field(
+        name="💽 Audio cache",
+        value=(
+            f"{len(audio_cache_index)} tracks, {cached_bytes / (1024 * 1024):.1f} / {AUDIO_CACHE_MAX_BYTES / (1024 * 1024):.0f} MB\n"
+            f"Hits: {audio_cache_stats['hits']}, misses: {audio_cache_stats['misses']} ({hit_rate} hit rate), "
+            f"evictions: {audio_cache_stats['evictions']}"
+        ),
+        inline=False
+    )
+    embed.add_field(
+        name="🔗 Stream URLs",
+        value=(
+            f"{len(stream_url_cache)} cached, hits: {stream_url_stats['hits']}, misses: {stream_url_stats['misses']}\n"
+            f"Refreshed ahead: {stream_url_stats['refreshes']}, re-resolved after early failure: {stream_url_stats['retries']}"
+        ),
+        inline=False
+    )
+    persist_stats = persister.stats
+    latencies = persister.flush_latencies
+    flush_line = (
+        f"avg {sum(latencies) / len(latencies) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms"
+        if latencies else "no flushes yet"
+    )
+    embed.add_field(
+        name="💾 Persistence",
+        value=(
+            f"Saves: {persist_stats['saves']} in {persist_stats['flushes']} flushes "
+            f"({persist_stats['coalesced']} coalesced, {persist_stats['failures']} failed, {persister.backlog} pending)\n"
+            f"Written: {persist_stats['bytes_written'] / 1024:.1f} KB of JSON, flush latency {flush_line}"
+        ),
+        inline=False
+    )
+    embed.add_field(
+        name="⏱️ Time to first audio",
+        value="\n".join(
+            [f"{mode.title()}: {latency_line(samples)}" for mode, samples in start_latency_samples.items()]
+            + [f"From !play: {latency_line(play_command_latency)}"]
+        ),
+        inline=False
+    )
+    await ctx.send(embed=embed)
+
+@bot.command(aliases=["diskstats", "storage"])
+async def storagestats(ctx):
+    """Shows upload disk usage: bytes uploaded vs. bytes actually stored after deduplication."""
+    catalogs = list(upload_catalog_by_guild.values())
+    logical_bytes = sum(catalog.total_size for catalog in catalogs)
+    physical_bytes = sum(blob["size"] for blob in upload_blobs.values())
+    upload_count = sum(len(catalog) for catalog in catalogs)
+    saved_bytes = max(logical_bytes - physical_bytes, 0)
+    saved_share = f"{saved_bytes / logical_bytes:.0%}" if logical_bytes else "n/a"
+
+    catalog = upload_catalog_by_guild[ctx.guild.id]
+    shared = sum(1 for upload in catalog if len(upload_blobs.get(upload.path, {}).get("uploads", ())) > 1)
+    normalized = sum(1 for upload in catalog if upload.loudness_gain is not None)
+
+    embed = discord.Embed(title="💾 Echosol Storage", color=discord.Color.blurple())
+    embed.add_field(
+        name="🌍 All servers",
+        value=(
+            f"{upload_count} uploads stored as {len(upload_blobs)} files\n"
+            f"Logical: **{format_size(logical_bytes)}**, on disk: **{format_size(physical_bytes)}**\n"
+            f"Saved by deduplication: {format_size(saved_bytes)} ({saved_share})"
+        ),
+        inline=False
+    )
+    embed.add_field(
+        name="🏠 This server",
+        value=(
+            f"{len(catalog)} uploads, {format_size(catalog.total_size)} of {format_size(GUILD_UPLOAD_QUOTA_BYTES)} quota\n"
+            f"{shared} shared with other uploads\n"
+            f"{normalized} loudness-normalized to {LOUDNESS_TARGET_LUFS:g} LUFS"
+        ),
+        inline=False
+    )
+    await ctx.send(embed=embed)
 
 # Run the bot
 TOKEN = os.getenv("TOKEN")  # Reads token from environment variables
 load_upload_data()
 load_playlists()
-bot.run(TOKEN)
\ No newline at end of file
+load_metadata_cache()
+load_audio_cache_index()
+bot.run(TOKEN)
+save_metadata_cache()
+save_audio_cache_index()
+persister.close()
\ No newline at end of file
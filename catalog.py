@@ -0,0 +1,138 @@
+"""Upload catalog for Echosol.
+
+Every upload gets a stable integer ID that never changes or gets reused,
+so deleting a song doesn't renumber the ones after it, and tags, queues
+and playlists can point at an upload without repeating its filename.
+Each guild's catalog answers lookups by ID or by name in O(1) and keeps
+its IDs sorted (which is upload order) for paging.
+"""
+import bisect
+
+# Filled in at ingest by the worker pool's probe job
+PROBE_FIELDS = ("duration", "codec", "sample_rate", "channels", "bitrate")
+
+
+class Upload:
+    """One uploaded file. Field order matches storage.UPLOAD_COLUMNS."""
+
+    __slots__ = (
+        "id", "guild_id", "filename", "path", "size", "duration", "added_by", "added_at", "sha256",
+        "codec", "sample_rate", "channels", "bitrate", "loudness_gain",
+    )
+
+    def __init__(
+        self, id, guild_id, filename, path, size=None, duration=None, added_by=None, added_at=None, sha256=None,
+        codec=None, sample_rate=None, channels=None, bitrate=None, loudness_gain=None,
+    ):
+        self.id = id
+        self.guild_id = guild_id
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.duration = duration
+        self.added_by = added_by
+        self.added_at = added_at
+        self.sha256 = sha256
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bitrate = bitrate
+        self.loudness_gain = loudness_gain  # dB to reach the loudness target, measured in the background
+
+    def apply_probe(self, probe):
+        """Copies ffprobe results onto the record. Returns them as {column: value} for the store."""
+        fields = {field: probe.get(field) for field in PROBE_FIELDS}
+        for field, value in fields.items():
+            setattr(self, field, value)
+        return fields
+
+    def as_row(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return f"Upload({self.id}, {self.filename!r})"
+
+
+class UploadCatalog:
+    """One guild's uploads, indexed by ID and by filename."""
+
+    def __init__(self, uploads=()):
+        self.by_id = {}
+        self.id_by_name = {}
+        self.ids = []  # Sorted, i.e. upload order. Queued LazySegments take a snapshot of it
+        self.total_size = 0  # Bytes across all uploads, for the per-guild quota
+        for upload in uploads:
+            self.add(upload)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __bool__(self):
+        return bool(self.ids)
+
+    def __contains__(self, upload_id):
+        return upload_id in self.by_id
+
+    def __iter__(self):
+        """Yields uploads in upload order."""
+        for upload_id in self.ids:
+            yield self.by_id[upload_id]
+
+    def get(self, upload_id):
+        return self.by_id.get(upload_id)
+
+    def find(self, filename):
+        upload_id = self.id_by_name.get(filename)
+        return self.by_id[upload_id] if upload_id is not None else None
+
+    def page(self, start, count):
+        """Returns up to `count` uploads starting at position `start`."""
+        return [self.by_id[upload_id] for upload_id in self.ids[max(start, 0):start + count]]
+
+    def position(self, upload_id):
+        """Position of an ID in upload order, or None. Used to find the page a song is on."""
+        index = bisect.bisect_left(self.ids, upload_id)
+        return index if index < len(self.ids) and self.ids[index] == upload_id else None
+
+    # --- edits ---
+
+    def add(self, upload):
+        self.by_id[upload.id] = upload
+        self.total_size += upload.size or 0
+        self.id_by_name[upload.filename] = upload.id
+        if not self.ids or upload.id > self.ids[-1]:
+            self.ids.append(upload.id)
+        else:
+            bisect.insort(self.ids, upload.id)
+
+    def remove(self, upload_id):
+        """Removes and returns an upload, or None if it isn't in this catalog."""
+        upload = self.by_id.pop(upload_id, None)
+        if upload is None:
+            return None
+        del self.id_by_name[upload.filename]
+        del self.ids[self.position(upload_id)]
+        self.total_size -= upload.size or 0
+        return upload
+
+    def rename(self, upload_id, filename):
+        """Changes an upload's display name. Returns False if the name is taken or the ID unknown."""
+        upload = self.by_id.get(upload_id)
+        if upload is None or filename in self.id_by_name:
+            return False
+        del self.id_by_name[upload.filename]
+        upload.filename = filename
+        self.id_by_name[filename] = upload_id
+        return True
+
+    def resize(self, upload_id, size):
+        """Records a new file size for an upload whose content was replaced."""
+        upload = self.by_id[upload_id]
+        self.total_size += (size or 0) - (upload.size or 0)
+        upload.size = size
+
+    def clear(self):
+        self.total_size = 0
+        self.by_id.clear()
+        self.id_by_name.clear()
+        self.ids.clear()
@@ -0,0 +1,97 @@
+"""Write-behind persistence for Echosol.
+
+Commands and events only hand a write to the persister and move on; a
+single background thread waits a short window for the rest of a burst,
+then runs everything that piled up. Writes submitted under the same key
+replace each other while they wait, so ten edits to one file become one
+save, and a slow disk never blocks the event loop that drives voice.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class WriteBehindPersister:
+    """Coalesces writes and runs them off the event loop on one worker thread."""
+
+    def __init__(self, window=0.5, name="echosol-persister"):
+        self.window = window
+        self.pending = OrderedDict()  # {key: (label, write, args)} in submission order
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.writing = False
+        self.closed = False
+        self.stats = {
+            "submitted": 0, "coalesced": 0, "saves": 0,
+            "failures": 0, "flushes": 0, "bytes_written": 0,
+        }
+        self.flush_latencies = deque(maxlen=100)  # Seconds per batch, most recent last
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    @property
+    def backlog(self):
+        return len(self.pending)
+
+    def submit(self, write, *args, key=None, label="data"):
+        """Queues `write(*args)`. A pending write with the same `key` is replaced rather than repeated.
+
+        `write` may return the number of bytes it wrote, which feeds the metrics.
+        """
+        with self.condition:
+            if self.closed:
+                self._write_batch([(label, write, args)])  # Late saves during shutdown run inline
+                return
+            if key is None:
+                key = ("unkeyed", next(self.sequence))
+            elif key in self.pending:
+                del self.pending[key]  # Re-inserted at the end so ordering follows the latest write
+                self.stats["coalesced"] += 1
+            self.pending[key] = (label, write, args)
+            self.stats["submitted"] += 1
+            self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if not self.pending:
+                    return
+                closing = self.closed
+            if not closing:
+                time.sleep(self.window)  # Let the rest of a burst arrive first
+            with self.condition:
+                batch = list(self.pending.values())
+                self.pending.clear()
+                self.writing = True
+            self._write_batch(batch)
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def _write_batch(self, batch):
+        started = time.perf_counter()
+        for label, write, args in batch:
+            try:
+                written = write(*args)
+                self.stats["saves"] += 1
+                if isinstance(written, int):
+                    self.stats["bytes_written"] += written
+            except Exception as e:
+                self.stats["failures"] += 1
+                print(f"[Save Error] Could not save {label}: {e}")
+        self.stats["flushes"] += 1
+        self.flush_latencies.append(time.perf_counter() - started)
+
+    def flush(self, timeout=None):
+        """Blocks until everything submitted so far is on disk. Returns False on timeout."""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.writing, timeout)
+
+    def close(self, timeout=30):
+        """Flushes what is pending and stops the worker thread; later submits run inline."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
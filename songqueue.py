@@ -0,0 +1,294 @@
+"""Indexed song queue for Echosol.
+
+A plain list makes `pop(0)`, insert and remove O(n), which hurts once a
+guild queues a whole upload library. SongQueue keeps entries in chunks of
+a few hundred items and a Fenwick tree over the chunk sizes, so finding a
+position is O(log n) and every positional edit only touches one small chunk.
+"""
+import random
+
+CHUNK_SIZE = 256
+
+
+class SeededPermutation:
+    """A random bijection on range(size) that uses constant memory.
+
+    A small Feistel network scrambles indexes over the next power-of-four
+    domain; cycle walking folds the result back into range(size). Looking
+    up position i never needs the positions before it.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.half_bits = max(1, ((max(size, 2) - 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.half_bits) - 1
+        rng = random.Random(seed)
+        self.keys = [rng.getrandbits(32) for _ in range(self.ROUNDS)]
+
+    def _round(self, value, key):
+        value = (value * 0x9E3779B1 + key) & 0xFFFFFFFF
+        value ^= value >> 15
+        return (value * 0x85EBCA6B) & self.mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self.half_bits) | right
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError("permutation index out of range")
+        value = self._encrypt(index)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+
+class LazySegment:
+    """One queue entry standing in for a whole run of songs.
+
+    It walks `source` between `start` and `stop`, optionally in a seeded
+    shuffled order, and only turns an item into a concrete queue entry (via
+    `to_entry`) when it is about to play. `source` must not change while the
+    segment is queued, so pass a snapshot of what was selected (e.g. the
+    upload IDs of a page) rather than a live list: deleting an item from a
+    live list would shift every later position. `to_entry` may return None
+    for items that have gone away since, and those are skipped.
+    """
+
+    def __init__(self, source, label, to_entry=None, shuffle=False, start=0, stop=None, seed=None):
+        self.source = source
+        self.label = label
+        self.to_entry = to_entry or (lambda item: item)
+        self.start = start
+        self.size = (len(source) if stop is None else min(stop, len(source))) - start
+        self.size = max(self.size, 0)
+        self.order = SeededPermutation(self.size, seed) if shuffle else None
+        self.reshuffles = []  # (first unplayed position, permutation of the rest) per reshuffle, oldest first
+        self.position = 0
+
+    @property
+    def remaining(self):
+        return self.size - self.position
+
+    def _item_at(self, position):
+        # Each reshuffle renumbered the unplayed songs, so map back through them newest first
+        for base, permutation in reversed(self.reshuffles):
+            position = base + permutation[position]
+        offset = self.order[position] if self.order else position
+        index = self.start + offset
+        # The source may have shrunk since the segment was queued; those slots are skipped
+        return self.source[index] if index < len(self.source) else None
+
+    def _entry_at(self, position):
+        item = self._item_at(position)
+        return self.to_entry(item) if item is not None else None
+
+    def take(self):
+        """Returns the next concrete entry, or None once the segment is used up."""
+        while self.position < self.size:
+            entry = self._entry_at(self.position)
+            self.position += 1
+            if entry is not None:
+                return entry
+        return None
+
+    def __iter__(self):
+        """Iterates the remaining entries without consuming them."""
+        for position in range(self.position, self.size):
+            entry = self._entry_at(position)
+            if entry is not None:
+                yield entry
+
+    def reshuffle(self, seed=None):
+        """Puts the songs not played yet into a new random order, without copying them."""
+        self.size = self.remaining
+        self.reshuffles.append((self.position, SeededPermutation(self.size, seed)))
+        self.position = 0
+
+    def __str__(self):
+        return f"{self.label} — {self.remaining} song(s) left"
+
+
+class SongQueue:
+    """A list-like queue with cheap dequeue, insert-at, remove-at, move and paging."""
+
+    def __init__(self, items=()):
+        self._chunks = []
+        self._len = 0
+        self._tree = None  # Fenwick tree over chunk lengths, rebuilt lazily
+        self.extend(items)
+
+    # --- Fenwick bookkeeping ---
+
+    def _rebuild_tree(self):
+        tree = [0] * (len(self._chunks) + 1)
+        for i, chunk in enumerate(self._chunks, start=1):
+            tree[i] += len(chunk)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, chunk_index, delta):
+        if self._tree is None:
+            return
+        i = chunk_index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _locate(self, index):
+        """Maps a queue position to (chunk index, offset inside the chunk)."""
+        if self._tree is None:
+            self._rebuild_tree()
+        position = 0
+        remaining = index
+        step = 1 << (len(self._chunks).bit_length())
+        while step:
+            next_position = position + step
+            if next_position < len(self._tree) and self._tree[next_position] <= remaining:
+                position = next_position
+                remaining -= self._tree[next_position]
+            step >>= 1
+        return position, remaining
+
+    def _normalize(self, index, inserting=False):
+        limit = self._len + 1 if inserting else self._len
+        if index < 0:
+            index += self._len
+        if inserting:
+            return min(max(index, 0), self._len)
+        if not 0 <= index < limit:
+            raise IndexError("queue index out of range")
+        return index
+
+    # --- list-like reads ---
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __contains__(self, item):
+        return any(item in chunk for chunk in self._chunks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return list(self)[index]
+            return self.page(start, stop - start)
+        chunk_index, offset = self._locate(self._normalize(index))
+        return self._chunks[chunk_index][offset]
+
+    def page(self, start, count):
+        """Returns up to `count` entries starting at `start` without copying the rest of the queue."""
+        if count <= 0 or start >= self._len:
+            return []
+        chunk_index, offset = self._locate(max(start, 0))
+        items = []
+        while chunk_index < len(self._chunks) and len(items) < count:
+            chunk = self._chunks[chunk_index]
+            items.extend(chunk[offset:offset + count - len(items)])
+            chunk_index += 1
+            offset = 0
+        return items
+
+    # --- edits ---
+
+    def append(self, item):
+        if not self._chunks or len(self._chunks[-1]) >= CHUNK_SIZE:
+            self._chunks.append([item])
+            self._tree = None
+        else:
+            self._chunks[-1].append(item)
+            self._tree_add(len(self._chunks) - 1, 1)
+        self._len += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def insert(self, index, item):
+        index = self._normalize(index, inserting=True)
+        if index == self._len:
+            self.append(item)
+            return
+        chunk_index, offset = self._locate(index)
+        chunk = self._chunks[chunk_index]
+        chunk.insert(offset, item)
+        self._len += 1
+        if len(chunk) > 2 * CHUNK_SIZE:
+            self._chunks[chunk_index:chunk_index + 1] = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+            self._tree = None
+        else:
+            self._tree_add(chunk_index, 1)
+
+    def pop(self, index=-1):
+        index = self._normalize(index)
+        chunk_index, offset = self._locate(index)
+        chunk = self._chunks[chunk_index]
+        item = chunk.pop(offset)
+        self._len -= 1
+        if chunk:
+            self._tree_add(chunk_index, -1)
+        else:
+            del self._chunks[chunk_index]
+            self._tree = None
+        return item
+
+    def popleft(self):
+        return self.pop(0)
+
+    def pop_next(self):
+        """Dequeues the next concrete song, expanding a LazySegment at the head one song at a time."""
+        while self._len:
+            head = self[0]
+            if not isinstance(head, LazySegment):
+                return self.popleft()
+            item = head.take()
+            if head.remaining == 0:
+                self.popleft()
+            if item is not None:
+                return item
+        raise IndexError("pop from an empty queue")
+
+    def song_count(self):
+        """Number of songs left, counting every song a LazySegment still stands for."""
+        return sum(entry.remaining if isinstance(entry, LazySegment) else 1 for entry in self)
+
+    def move(self, source, destination):
+        """Moves the entry at `source` so it ends up at position `destination`."""
+        item = self.pop(source)
+        self.insert(self._normalize(destination, inserting=True), item)
+        return item
+
+    def clear(self):
+        self._chunks = []
+        self._len = 0
+        self._tree = None
+
+    def shuffle(self, rng=random):
+        """Shuffles the entries, and the songs inside each LazySegment as well."""
+        items = list(self)
+        rng.shuffle(items)
+        for item in items:
+            if isinstance(item, LazySegment):
+                item.reshuffle(rng.getrandbits(32))
+        self.clear()
+        self.extend(items)
+
+    def __repr__(self):
+        return f"SongQueue({len(self)} entries)"
@@ -0,0 +1,405 @@
+"""SQLite storage for Echosol's uploads, tags and playlists.
+
+Replaces the whole-file rewrites of uploads_data.json and playlists.json:
+every change is a small row-level upsert or delete inside a transaction,
+so persistence cost scales with what changed rather than with the size of
+every guild's data. The database runs in WAL mode, which keeps writes
+crash-safe.
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT,
+    size INTEGER,
+    duration REAL,
+    added_by INTEGER,
+    added_at REAL,
+    sha256 TEXT,
+    codec TEXT,
+    sample_rate INTEGER,
+    channels INTEGER,
+    bitrate INTEGER,
+    loudness_gain REAL,
+    UNIQUE (guild_id, filename)
+);
+CREATE TABLE IF NOT EXISTS upload_tags (
+    upload_id INTEGER NOT NULL REFERENCES uploads (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (upload_id, tag)
+);
+CREATE INDEX IF NOT EXISTS upload_tags_by_tag ON upload_tags (tag);
+
+CREATE TABLE IF NOT EXISTS playlists (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (guild_id, name)
+);
+CREATE TABLE IF NOT EXISTS playlist_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    playlist_id INTEGER NOT NULL REFERENCES playlists (id) ON DELETE CASCADE,
+    position REAL NOT NULL,
+    value TEXT NOT NULL,
+    title TEXT
+);
+CREATE INDEX IF NOT EXISTS playlist_entries_by_position ON playlist_entries (playlist_id, position);
+"""
+
+# Upload record fields, in catalog.Upload order
+UPLOAD_COLUMNS = (
+    "id", "guild_id", "filename", "path", "size", "duration", "added_by", "added_at", "sha256",
+    "codec", "sample_rate", "channels", "bitrate", "loudness_gain",
+)
+
+# Columns added after the first release of the uploads table
+ADDED_UPLOAD_COLUMNS = {
+    "path": "TEXT", "size": "INTEGER", "duration": "REAL", "added_by": "INTEGER", "added_at": "REAL",
+    "sha256": "TEXT", "codec": "TEXT", "sample_rate": "INTEGER", "channels": "INTEGER", "bitrate": "INTEGER",
+    "loudness_gain": "REAL",
+}
+
+
+# One connection and lock per database file, shared by every store on it, so their
+# transactions queue on the lock instead of waiting out SQLite's busy timeout
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def _open_database(path):
+    db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("PRAGMA foreign_keys=ON")
+    db.executescript(SCHEMA)
+    existing = {row[1] for row in db.execute("PRAGMA table_info(uploads)")}
+    for column, column_type in ADDED_UPLOAD_COLUMNS.items():
+        if column not in existing:
+            db.execute(f"ALTER TABLE uploads ADD COLUMN {column} {column_type}")
+    return db
+
+
+def shared_connection(path):
+    """Returns (connection, lock) for a database file, opening it on first use."""
+    key = os.path.abspath(path)
+    with _connections_lock:
+        if key not in _connections:
+            _connections[key] = (_open_database(path), threading.Lock())
+        return _connections[key]
+
+
+class SQLiteStore:
+    """Shared connection setup and transactions for the repositories below."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db, self.lock = shared_connection(path)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def read(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+
+class UploadStore(SQLiteStore):
+    """Repository for uploads and their tags. Uploads are addressed by their stable ID."""
+
+    def _upload_id(self, db, guild_id, filename):
+        row = db.execute(
+            "SELECT id FROM uploads WHERE guild_id = ? AND filename = ?", (guild_id, filename)
+        ).fetchone()
+        return row[0] if row else None
+
+    # --- reads ---
+
+    def is_empty(self):
+        return not self.read("SELECT 1 FROM uploads LIMIT 1")
+
+    def last_upload_id(self):
+        """Highest ID ever handed out, deleted or not, so new uploads never reuse an ID."""
+        rows = self.read("SELECT seq FROM sqlite_sequence WHERE name = 'uploads'")
+        return rows[0][0] if rows else 0
+
+    def load_all(self):
+        """Returns ({guild_id: [upload rows in ID order]}, {guild_id: {upload_id: [tags]}})."""
+        uploads_by_guild = {}
+        tags_by_guild = {}
+        columns = ", ".join(UPLOAD_COLUMNS)
+        for row in self.read(f"SELECT {columns} FROM uploads ORDER BY id"):
+            uploads_by_guild.setdefault(row[1], []).append(row)
+        for guild_id, upload_id, tag in self.read(
+            "SELECT u.guild_id, t.upload_id, t.tag FROM upload_tags t "
+            "JOIN uploads u ON u.id = t.upload_id ORDER BY t.rowid"
+        ):
+            tags_by_guild.setdefault(guild_id, {}).setdefault(upload_id, []).append(tag)
+        return uploads_by_guild, tags_by_guild
+
+    # --- writes ---
+
+    def add_upload(self, row):
+        """Inserts an upload row (UPLOAD_COLUMNS order). The ID is assigned by the caller."""
+        placeholders = ", ".join("?" for _ in UPLOAD_COLUMNS)
+        with self.transaction() as db:
+            db.execute(f"INSERT INTO uploads ({', '.join(UPLOAD_COLUMNS)}) VALUES ({placeholders})", row)
+
+    def update_upload(self, upload_id, fields):
+        """Updates some of an upload's fields, given as {column: value}."""
+        unknown = set(fields) - set(UPLOAD_COLUMNS[2:])
+        if unknown:
+            raise ValueError(f"unknown upload fields: {', '.join(sorted(unknown))}")
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        with self.transaction() as db:
+            db.execute(f"UPDATE uploads SET {assignments} WHERE id = ?", (*fields.values(), upload_id))
+
+    def remove_uploads(self, upload_ids):
+        with self.transaction() as db:
+            db.executemany("DELETE FROM uploads WHERE id = ?", [(upload_id,) for upload_id in upload_ids])
+
+    def clear_guild(self, guild_id):
+        with self.transaction() as db:
+            db.execute("DELETE FROM uploads WHERE guild_id = ?", (guild_id,))
+
+    def add_tags(self, upload_ids, tags):
+        with self.transaction() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO upload_tags (upload_id, tag) VALUES (?, ?)",
+                [(upload_id, tag) for upload_id in upload_ids for tag in tags],
+            )
+
+    def clear_tags(self, upload_ids):
+        with self.transaction() as db:
+            db.executemany("DELETE FROM upload_tags WHERE upload_id = ?", [(upload_id,) for upload_id in upload_ids])
+
+    def remove_tag(self, guild_id, tag):
+        with self.transaction() as db:
+            db.execute(
+                "DELETE FROM upload_tags WHERE tag = ? AND upload_id IN "
+                "(SELECT id FROM uploads WHERE guild_id = ?)",
+                (tag, guild_id),
+            )
+
+    # --- migration ---
+
+    def migrate_from_json(self, json_path):
+        """One-time import of uploads_data.json. The file is renamed once the import commits."""
+        if not os.path.exists(json_path) or not self.is_empty():
+            return False
+        with open(json_path, "r") as f:
+            data = json.load(f)
+
+        with self.transaction() as db:
+            for guild_id, files in data.get("uploaded_files_by_guild", {}).items():
+                db.executemany(
+                    "INSERT OR IGNORE INTO uploads (guild_id, filename) VALUES (?, ?)",
+                    [(int(guild_id), filename) for filename in files],
+                )
+            for guild_id, file_tags in data.get("file_tags_by_guild", {}).items():
+                for filename, tags in file_tags.items():
+                    upload_id = self._upload_id(db, int(guild_id), filename)
+                    if upload_id is None:
+                        continue
+                    db.executemany(
+                        "INSERT OR IGNORE INTO upload_tags (upload_id, tag) VALUES (?, ?)",
+                        [(upload_id, tag) for tag in tags],
+                    )
+        os.replace(json_path, json_path + ".migrated")
+        return True
+
+
+class PlaylistStore(SQLiteStore):
+    """Repository for saved playlists with per-entry incremental writes.
+
+    Entries are ordered by a REAL position with gaps between neighbours, so
+    an insert takes the midpoint of its neighbours and a removal deletes a
+    single row; nothing else in the playlist is rewritten.
+    """
+
+    PAGE_SIZE = 500
+
+    def _playlist_id(self, db, guild_id, name):
+        row = db.execute(
+            "SELECT id FROM playlists WHERE guild_id = ? AND name = ?", (guild_id, name)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _next_position(self, db, playlist_id):
+        row = db.execute(
+            "SELECT MAX(position) FROM playlist_entries WHERE playlist_id = ?", (playlist_id,)
+        ).fetchone()
+        return (row[0] or 0) + 1
+
+    def _renumber(self, db, playlist_id):
+        rows = db.execute(
+            "SELECT id FROM playlist_entries WHERE playlist_id = ? ORDER BY position", (playlist_id,)
+        ).fetchall()
+        db.executemany(
+            "UPDATE playlist_entries SET position = ? WHERE id = ?",
+            [(index + 1, entry_id) for index, (entry_id,) in enumerate(rows)],
+        )
+
+    # --- playlists ---
+
+    def exists(self, guild_id, name):
+        return bool(self.read("SELECT 1 FROM playlists WHERE guild_id = ? AND name = ?", (guild_id, name)))
+
+    def create(self, guild_id, name):
+        """Returns False if the playlist already exists."""
+        with self.transaction() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO playlists (guild_id, name) VALUES (?, ?)", (guild_id, name)
+            )
+            return cursor.rowcount > 0
+
+    def delete(self, guild_id, name):
+        with self.transaction() as db:
+            cursor = db.execute("DELETE FROM playlists WHERE guild_id = ? AND name = ?", (guild_id, name))
+            return cursor.rowcount > 0
+
+    def summaries(self, guild_id):
+        """Returns [(name, entry count)] for a guild's playlists."""
+        return self.read(
+            "SELECT p.name, COUNT(e.id) FROM playlists p "
+            "LEFT JOIN playlist_entries e ON e.playlist_id = p.id "
+            "WHERE p.guild_id = ? GROUP BY p.id ORDER BY p.id",
+            (guild_id,),
+        )
+
+    def count(self, guild_id, name):
+        rows = self.read(
+            "SELECT COUNT(e.id) FROM playlists p JOIN playlist_entries e ON e.playlist_id = p.id "
+            "WHERE p.guild_id = ? AND p.name = ?",
+            (guild_id, name),
+        )
+        return rows[0][0] if rows else 0
+
+    # --- entries ---
+
+    def append(self, guild_id, name, entries):
+        """Appends (value, title) pairs in one transaction. Returns how many were added, or None."""
+        with self.transaction() as db:
+            playlist_id = self._playlist_id(db, guild_id, name)
+            if playlist_id is None:
+                return None
+            position = self._next_position(db, playlist_id)
+            rows = [
+                (playlist_id, position + offset, value, title)
+                for offset, (value, title) in enumerate(entries)
+            ]
+            db.executemany(
+                "INSERT INTO playlist_entries (playlist_id, position, value, title) VALUES (?, ?, ?, ?)", rows
+            )
+            return len(rows)
+
+    def insert(self, guild_id, name, index, value, title=None):
+        """Inserts an entry before the 0-based `index`. Returns False if the playlist doesn't exist."""
+        with self.transaction() as db:
+            playlist_id = self._playlist_id(db, guild_id, name)
+            if playlist_id is None:
+                return False
+            neighbours = db.execute(
+                "SELECT position FROM playlist_entries WHERE playlist_id = ? "
+                "ORDER BY position LIMIT 2 OFFSET ?",
+                (playlist_id, max(index - 1, 0)),
+            ).fetchall()
+            if index <= 0:
+                position = (neighbours[0][0] - 1) if neighbours else 1
+            elif len(neighbours) == 2:
+                before, after = neighbours[0][0], neighbours[1][0]
+                position = (before + after) / 2
+                if not before < position < after:  # Out of float precision; spread the gaps again
+                    self._renumber(db, playlist_id)
+                    position = index + 0.5
+            else:
+                position = self._next_position(db, playlist_id)
+            db.execute(
+                "INSERT INTO playlist_entries (playlist_id, position, value, title) VALUES (?, ?, ?, ?)",
+                (playlist_id, position, value, title),
+            )
+            return True
+
+    def remove_at(self, guild_id, name, index):
+        """Removes the entry at 0-based `index` and returns its value, or None if there isn't one."""
+        with self.transaction() as db:
+            row = db.execute(
+                "SELECT e.id, e.value FROM playlist_entries e JOIN playlists p ON p.id = e.playlist_id "
+                "WHERE p.guild_id = ? AND p.name = ? ORDER BY e.position LIMIT 1 OFFSET ?",
+                (guild_id, name, index),
+            ).fetchone() if index >= 0 else None
+            if row is None:
+                return None
+            db.execute("DELETE FROM playlist_entries WHERE id = ?", (row[0],))
+            return row[1]
+
+    def iter_entries(self, guild_id, name):
+        """Yields (value, title) in order, one page at a time, without loading the whole playlist."""
+        rows = self.read("SELECT id FROM playlists WHERE guild_id = ? AND name = ?", (guild_id, name))
+        if not rows:
+            return
+        playlist_id = rows[0][0]
+        last_position = float("-inf")
+        while True:
+            page = self.read(
+                "SELECT position, value, title FROM playlist_entries "
+                "WHERE playlist_id = ? AND position > ? ORDER BY position LIMIT ?",
+                (playlist_id, last_position, self.PAGE_SIZE),
+            )
+            for position, value, title in page:
+                yield value, title
+            if len(page) < self.PAGE_SIZE:
+                return
+            last_position = page[-1][0]
+
+    # --- export & migration ---
+
+    def export_guild(self, guild_id, file):
+        """Streams a guild's playlists as JSON ({name: [entries]}) into an open text file."""
+        file.write("{")
+        for playlist_index, (name, _) in enumerate(self.summaries(guild_id)):
+            file.write(("," if playlist_index else "") + json.dumps(name) + ": [")
+            for entry_index, (value, title) in enumerate(self.iter_entries(guild_id, name)):
+                entry = [value, title] if title is not None else value
+                file.write(("," if entry_index else "") + json.dumps(entry))
+            file.write("]")
+        file.write("}")
+
+    def migrate_from_json(self, json_path):
+        """One-time import of playlists.json. The file is renamed once the import commits."""
+        if not os.path.exists(json_path) or self.read("SELECT 1 FROM playlists LIMIT 1"):
+            return False
+        with open(json_path, "r") as f:
+            content = f.read()
+        data = json.loads(content) if content.strip() else {}
+
+        with self.transaction() as db:
+            for guild_id, playlists in data.items():
+                for name, entries in playlists.items():
+                    db.execute(
+                        "INSERT OR IGNORE INTO playlists (guild_id, name) VALUES (?, ?)", (int(guild_id), name)
+                    )
+                    playlist_id = self._playlist_id(db, int(guild_id), name)
+                    db.executemany(
+                        "INSERT INTO playlist_entries (playlist_id, position, value, title) VALUES (?, ?, ?, ?)",
+                        [
+                            (playlist_id, index + 1, *(entry if isinstance(entry, list) else (entry, None)))
+                            for index, entry in enumerate(entries)
+                        ],
+                    )
+        os.replace(json_path, json_path + ".migrated")
+        return True
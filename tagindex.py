@@ -0,0 +1,127 @@
+"""Inverted tag index for Echosol's uploads.
+
+Keeps both directions per guild: the tags of each upload (by upload ID)
+and the uploads of each tag. Every edit updates both sides in place, so
+listing tags, counting them and answering `chill +night -sad` style
+queries never has to walk the whole upload library.
+"""
+
+
+def parse_tag_query(terms):
+    """Splits query terms into (any_of, all_of, none_of).
+
+    Bare terms match if any of them is present, `+tag` must be present and
+    `-tag` must be absent: `chill lofi +night -sad`.
+    """
+    any_of, all_of, none_of = [], [], []
+    for term in terms:
+        term = term.strip(",").lower()
+        if term.startswith("+") and len(term) > 1:
+            all_of.append(term[1:])
+        elif term.startswith("-") and len(term) > 1:
+            none_of.append(term[1:])
+        elif term:
+            any_of.append(term)
+    return any_of, all_of, none_of
+
+
+def describe_tag_query(any_of, all_of, none_of):
+    parts = [" or ".join(any_of)] if any_of else []
+    parts += [f"+{tag}" for tag in all_of] + [f"-{tag}" for tag in none_of]
+    return " ".join(parts)
+
+
+class TagIndex:
+    """Tags for one guild's uploads, indexed upload ID → tags and tag → upload IDs."""
+
+    def __init__(self, upload_tags=None):
+        self.tags_by_upload = {}  # {upload_id: [tags in the order they were added]}
+        self.uploads_by_tag = {}  # {tag: {upload_id: None}}
+        for upload_id, tags in (upload_tags or {}).items():
+            self.add(upload_id, tags)
+
+    def __contains__(self, upload_id):
+        return bool(self.tags_by_upload.get(upload_id))
+
+    def tags_of(self, upload_id):
+        return self.tags_by_upload.get(upload_id, [])
+
+    def uploads_with(self, tag):
+        return self.uploads_by_tag.get(tag, {})
+
+    def counts(self):
+        """Returns {tag: number of uploads carrying it}."""
+        return {tag: len(upload_ids) for tag, upload_ids in self.uploads_by_tag.items()}
+
+    def all_tags(self):
+        return sorted(self.uploads_by_tag)
+
+    # --- edits ---
+
+    def add(self, upload_id, tags):
+        """Adds tags to an upload and returns the ones it didn't have yet."""
+        current = self.tags_by_upload.setdefault(upload_id, [])
+        added = []
+        for tag in dict.fromkeys(tags):
+            if tag not in current:
+                current.append(tag)
+                self.uploads_by_tag.setdefault(tag, {})[upload_id] = None
+                added.append(tag)
+        return added
+
+    def clear_upload(self, upload_id):
+        """Removes every tag from an upload; returns whether it had any."""
+        tags = self.tags_by_upload.pop(upload_id, [])
+        for tag in tags:
+            upload_ids = self.uploads_by_tag[tag]
+            del upload_ids[upload_id]
+            if not upload_ids:
+                del self.uploads_by_tag[tag]
+        return bool(tags)
+
+    def remove_tag(self, tag):
+        """Removes a tag from every upload and returns the IDs that carried it."""
+        upload_ids = list(self.uploads_by_tag.pop(tag, {}))
+        for upload_id in upload_ids:
+            self.tags_by_upload[upload_id].remove(tag)
+            if not self.tags_by_upload[upload_id]:
+                del self.tags_by_upload[upload_id]
+        return upload_ids
+
+    def clear(self):
+        self.tags_by_upload.clear()
+        self.uploads_by_tag.clear()
+
+    # --- queries ---
+
+    def query(self, any_of=(), all_of=(), none_of=(), universe=None):
+        """Returns the upload IDs matching any of `any_of`, all of `all_of` and none of `none_of`.
+
+        The work is bounded by the smallest posting list the query can start
+        from, and results come back sorted, i.e. in upload order. Only a query
+        with nothing but exclusions needs `universe` (all upload IDs) to
+        subtract from.
+        """
+        if all_of:
+            postings = sorted((self.uploads_with(tag) for tag in all_of), key=len)
+            candidates = postings[0]
+            required = postings[1:]
+            wanted = set(any_of)
+        elif any_of:
+            candidates = {}
+            for tag in any_of:
+                candidates.update(self.uploads_with(tag))
+            required = ()
+            wanted = None
+        else:
+            candidates = universe or ()
+            required = ()
+            wanted = None
+
+        excluded = [self.uploads_with(tag) for tag in none_of]
+        return sorted(
+            upload_id for upload_id in candidates
+            if all(upload_id in posting for posting in required)
+            and (not wanted or any(tag in wanted for tag in self.tags_of(upload_id)))
+            and not any(upload_id in posting for posting in excluded)
+        )
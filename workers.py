@@ -0,0 +1,158 @@
+"""Worker process for Echosol's worker pools.
+
+Each worker reads one JSON job per line on stdin and answers with one JSON
+line on stdout. YoutubeDL instances are kept alive between jobs, so the
+extractor setup cost is paid once per process instead of once per song.
+The worker exits on its own when the bot closes its stdin.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import yt_dlp as youtube_dl
+
+# One warm YoutubeDL per distinct option set (download, stream, ...)
+_ydl_instances = {}
+
+# Only the fields the bot actually reads are sent back over the pipe
+INFO_KEYS = (
+    "id", "title", "duration", "webpage_url", "url", "format_id",
+    "acodec", "ext", "extractor_key", "_type", "http_headers", "playlist_count",
+)
+
+
+def get_ydl(options):
+    key = json.dumps(options, sort_keys=True)
+    ydl = _ydl_instances.get(key)
+    if ydl is None:
+        ydl = youtube_dl.YoutubeDL(options)
+        _ydl_instances[key] = ydl
+    return ydl
+
+
+def slim_info(info):
+    slim = {key: info[key] for key in INFO_KEYS if key in info}
+    if info.get("entries") is not None:
+        slim["entries"] = [slim_info(entry) if entry else None for entry in info["entries"]]
+    return slim
+
+
+def extract(job):
+    ydl = get_ydl(job["options"])
+    # Set per job, so paging through a playlist or downloading into a scratch folder reuses one warm instance
+    ydl.params["playlist_items"] = job.get("playlist_items")
+    ydl.params["paths"] = {"home": job["download_folder"]} if job.get("download_folder") else {}
+    info = ydl.sanitize_info(ydl.extract_info(job["url"], download=job.get("download", False)))
+    result = slim_info(info)
+    if job.get("download"):
+        downloads = info.get("requested_downloads")
+        result["filepath"] = downloads[0]["filepath"] if downloads else ydl.prepare_filename(info)
+    return result
+
+
+def run_ffmpeg(args):
+    result = subprocess.run(
+        ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", *args],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip()[-500:] or f"ffmpeg exited with {result.returncode}")
+    return result
+
+
+def probe(job):
+    """Reads an upload's audio properties with ffprobe. Raises if it has no playable audio."""
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error", "-select_streams", "a:0",
+            "-show_entries", "format=duration,bit_rate:stream=codec_name,sample_rate,channels,bit_rate",
+            "-of", "json", job["path"],
+        ],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip()[-500:] or "ffprobe could not read the file")
+    data = json.loads(result.stdout or "{}")
+    streams = data.get("streams") or []
+    if not streams:
+        raise RuntimeError("no audio stream found")
+    stream, container = streams[0], data.get("format", {})
+    duration = float(container.get("duration") or 0)
+    if duration <= 0:
+        raise RuntimeError("audio has no duration")
+    bitrate = stream.get("bit_rate") or container.get("bit_rate")
+    return {
+        "duration": duration,
+        "codec": stream.get("codec_name"),
+        "sample_rate": int(stream["sample_rate"]) if stream.get("sample_rate") else None,
+        "channels": stream.get("channels"),
+        "bitrate": int(bitrate) if bitrate else None,
+    }
+
+
+def loudness(job):
+    """Measures integrated loudness and true peak (EBU R128) with loudnorm's analysis pass."""
+    result = subprocess.run(
+        [
+            "ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-i", job["path"], "-vn",
+            "-af", "loudnorm=print_format=json", "-f", "null", "-",
+        ],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip()[-500:] or f"ffmpeg exited with {result.returncode}")
+    # loudnorm prints its measurements as the last JSON object on stderr
+    output = result.stderr
+    data = json.loads(output[output.rindex("{"):output.rindex("}") + 1])
+    integrated, true_peak = float(data["input_i"]), float(data["input_tp"])
+    if integrated == float("-inf"):
+        raise RuntimeError("track is silent")
+    return {"integrated": integrated, "true_peak": true_peak}
+
+
+def encode_opus(job):
+    """Encodes an upload into a Discord-ready Ogg Opus file next to it, optionally applying a static gain."""
+    temp_path = f"{job['target']}.{os.urandom(4).hex()}.part"  # Unique, in case the same target is encoded twice
+    gain_filter = ["-filter:a", f"volume={job['gain_db']}dB"] if job.get("gain_db") else []
+    try:
+        run_ffmpeg([
+            "-y", "-i", job["source"], "-vn", "-map_metadata", "-1", *gain_filter,
+            "-c:a", "libopus", "-b:a", f"{job['bitrate']}k", "-ar", "48000", "-ac", "2",
+            "-f", "ogg", temp_path,
+        ])
+        os.replace(temp_path, job["target"])
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return {"size": os.path.getsize(job["target"])}
+
+
+JOBS = {
+    "extract": extract,
+    "probe": probe,
+    "loudness": loudness,
+    "encode_opus": encode_opus,
+}
+
+
+def main():
+    # Keep the protocol on a private copy of stdout; anything a library prints goes to stderr
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        try:
+            reply = {"id": job.get("id"), "ok": True, "result": JOBS[job["op"]](job)}
+        except Exception as e:
+            reply = {"id": job.get("id"), "ok": False, "error": str(e)}
+        replies.write(json.dumps(reply) + "\n")
+        replies.flush()
+
+
+if __name__ == "__main__":
+    main()